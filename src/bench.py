@@ -0,0 +1,181 @@
+#!/bin/env python3
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import ply.lex as lex
+import grammars
+from clr import CLR_Parser
+
+def measure_throughput(name, nbytes, mode, optimize = False):
+    grammar, lexmodule, generate = grammars.workloads[name]
+    parser = CLR_Parser(*grammar(), mode = mode)
+    if optimize:
+        parser.optimize()
+    lexer = lex.lex(module = lexmodule)
+    data = generate(nbytes)
+
+    #allocations are counted as the blocks still allocated afterwards, that is the tokens and
+    #the tree kept per token, with the cyclic collector off so nothing is freed in between
+    gc.collect()
+    gc.disable()
+    try:
+        lexer.input(data)
+        blocks = sys.getallocatedblocks()
+        t = time.perf_counter()
+        toks = list(lexer)
+        lextime = time.perf_counter() - t
+        lexblocks = sys.getallocatedblocks() - blocks
+        ntokens = len(toks)
+
+        blocks = sys.getallocatedblocks()
+        t = time.perf_counter()
+        batch = lexer.tokenize_all(data)
+        batchtime = time.perf_counter() - t
+        batchblocks = sys.getallocatedblocks() - blocks
+        del batch
+
+        blocks = sys.getallocatedblocks()
+        t = time.perf_counter()
+        tree = parser.parse(toks)
+        parsetime = time.perf_counter() - t
+        parseblocks = sys.getallocatedblocks() - blocks
+        del tree, toks
+
+        lexer.input(data)
+        t = time.perf_counter()
+        parser.parse(lexer)
+        totaltime = time.perf_counter() - t
+    finally:
+        gc.enable()
+
+    phases = {}
+    for phase, elapsed, blocks in [('lex', lextime, lexblocks), ('batch', batchtime, batchblocks), ('parse', parsetime, parseblocks), ('total', totaltime, None)]:
+        phases[phase] = {
+            'time': elapsed,
+            'tokens_per_s': ntokens / elapsed,
+            'bytes_per_s': len(data) / elapsed,
+            'blocks_per_token': None if blocks is None else blocks / ntokens,
+        }
+    return {'workload': name, 'mode': mode, 'optimize': optimize, 'bytes': len(data), 'tokens': ntokens, **phases}
+
+def bench_throughput(names, megabytes, mode, optimize = False):
+    results = []
+    for name in names:
+        r = measure_throughput(name, int(megabytes * 1024 * 1024), mode, optimize)
+        print("{:6} {:6.1f}MB {:9} tokens".format(name, r['bytes'] / 1024 / 1024, r['tokens']))
+        for phase in ('lex', 'batch', 'parse', 'total'):
+            p = r[phase]
+            print("    {:6} {:7.3f}s {:10.0f} tokens/s {:7.2f} MB/s{}".format(phase, p['time'], p['tokens_per_s'], p['bytes_per_s'] / 1024 / 1024,
+                '' if p['blocks_per_token'] is None else " {:6.2f} blocks/token".format(p['blocks_per_token'])))
+        results.append(r)
+    return {'commit': git_commit(), 'python': platform.python_version(), 'results': results}
+
+def compare_throughput(old, new):
+    before = dict([(r['workload'], r) for r in old['results']])
+    print("\ncompared to {}:".format(old['commit']))
+    for r in new['results']:
+        o = before.get(r['workload'])
+        if o is None:
+            continue
+        print("{:6} {}".format(r['workload'], ", ".join(["{} tokens/s x{:.2f}".format(phase, r[phase]['tokens_per_s'] / o[phase]['tokens_per_s'])
+            for phase in ('lex', 'parse', 'total')])))
+
+def build_table(name, size, mode, workers = None):
+    grammar, start, terminals = grammars.make_grammar(name, size)
+
+    t = time.perf_counter()
+    parser = CLR_Parser(grammar, start, terminals, mode = mode, workers = workers)
+    elapsed = time.perf_counter() - t
+
+    #second build only to trace memory, tracemalloc slows down the first one too much
+    tracemalloc.start()
+    CLR_Parser(grammar, start, terminals, mode = mode, workers = workers)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    report = parser.report
+    return {
+        'grammar': name,
+        'size': size,
+        'mode': mode,
+        'workers': workers,
+        'productions': len(report.productions),
+        'time': elapsed,
+        'timings': report.timings,
+        'peak': peak,
+        **report.sizes,
+        **report.counts,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_tables(names, modes, sizes = None, workers = None):
+    results = []
+    for name in names:
+        for size in sizes if sizes and grammars.suites[name][1] != [None] else grammars.suites[name][1]:
+            for mode in modes:
+                #only the canonical construction runs in parallel
+                r = build_table(name, size, mode, workers if mode == 'clr' else None)
+                print("{:8} {:>4} {:6} {:5} productions {:6} states {:8.3f}s {:8}kB peak".format(
+                    name, '' if size is None else size, mode, r['productions'], r['states'], r['time'], r['peak'] // 1024))
+                results.append(r)
+    return {'commit': git_commit(), 'python': platform.python_version(), 'results': results}
+
+def compare_tables(old, new):
+    key = lambda r: (r['grammar'], r['size'], r['mode'])
+    before = dict([(key(r), r) for r in old['results']])
+    print("\ncompared to {}:".format(old['commit']))
+    for r in new['results']:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        print("{:8} {:>4} {:6} time x{:.2f} states {} -> {} peak x{:.2f}".format(
+            r['grammar'], '' if r['size'] is None else r['size'], r['mode'],
+            r['time'] / o['time'], o['states'], r['states'], r['peak'] / max(o['peak'], 1)))
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description = "Benchmarks for table construction and parsing")
+    commands = argparser.add_subparsers(dest = 'command', required = True)
+
+    throughputcmd = commands.add_parser('throughput', help = "lexing and parsing speed on generated inputs")
+    throughputcmd.add_argument('-w', '--workloads', nargs = '+', default = list(grammars.workloads), choices = list(grammars.workloads))
+    throughputcmd.add_argument('-b', '--megabytes', type = float, default = 4, help = "input size per workload")
+    throughputcmd.add_argument('-m', '--mode', default = 'lalr', choices = ['clr', 'lalr', 'pager'])
+    throughputcmd.add_argument('-O', '--optimize', action = 'store_true', help = "bypass unit reductions in the tables")
+    throughputcmd.add_argument('-o', '--output', metavar = 'FILE', help = "save the results as JSON")
+    throughputcmd.add_argument('-c', '--compare', metavar = 'FILE', help = "compare with results saved earlier")
+
+    tablescmd = commands.add_parser('tables', help = "table construction time, states and memory")
+    tablescmd.add_argument('-g', '--grammars', nargs = '+', default = list(grammars.suites), choices = list(grammars.suites))
+    tablescmd.add_argument('-m', '--modes', nargs = '+', default = ['clr', 'lalr', 'pager'], choices = ['clr', 'lalr', 'pager'])
+    tablescmd.add_argument('-s', '--sizes', nargs = '+', type = int, help = "sizes of the scalable grammars")
+    tablescmd.add_argument('-j', '--workers', type = int, help = "processes for the canonical construction")
+    tablescmd.add_argument('-o', '--output', metavar = 'FILE', help = "save the results as JSON")
+    tablescmd.add_argument('-c', '--compare', metavar = 'FILE', help = "compare with results saved earlier")
+
+    args = argparser.parse_args()
+
+    if args.command == 'throughput':
+        results = bench_throughput(args.workloads, args.megabytes, args.mode, args.optimize)
+        compare = compare_throughput
+    else:
+        results = bench_tables(args.grammars, args.modes, args.sizes, args.workers)
+        compare = compare_tables
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -1,15 +1,26 @@
 #!/bin/env python3
 
-import copy
+import hashlib
+import multiprocessing
+import os
+import pickle
+import re
+import time
+import tracemalloc
+from array import array
 from enum import Enum
 
 eol = '$'
 epsilon = 'epsilon'
 
+#bump whenever the layout of cached table files changes
+tabversion = 4
+
 class SRG(Enum):
     SHIFT = 0
     REDUCE = 1
     GOTO = 2
+    ERROR = 3
 
 class Action:
     def __init__(self, action, number):
@@ -19,6 +30,269 @@ class Action:
     def __repr__(self):
         return "({} {})".format(self.action, self.number)
 
+class ParseError(Exception):
+    def __init__(self, message, token):
+        self.args = (message,)
+        self.token = token
+
+class CompiledTable:
+    #actions are packed as ints: shift or goto to state s is s + 1, reduce by production Id is
+    #-(Id + 1) and 0 is an error, explicit errors left by nonassoc operators are stored as 0 so
+    #the default reduction does not apply to them. All rows share one comb vector: the entry of state s for
+    #symbol column c is value[base[s] + c] if check[base[s] + c] == c, otherwise default[s],
+    #the most frequent reduction of the row or an error. Goto columns are packed like shifts, so
+    #tokens are looked up in termindex, which only holds the terminal columns
+    def __init__(self, symbols, terminals, base, default, check, value):
+        self.symbols = symbols
+        self.terminals = terminals
+        self.symindex = dict([(sym, i) for i, sym in enumerate(symbols)])
+        self.termindex = dict([(sym, self.symindex[sym]) for sym in terminals])
+        self.base = base
+        self.default = default
+        self.check = check
+        self.value = value
+        #the packed rows, only kept by compile to be reused when the grammar changes
+        self.rows = None
+
+    @staticmethod
+    def compile(table, previous = None, reused = None, idmap = None):
+        #previous is the table compiled by an earlier build for an earlier version of the grammar
+        #and reused maps states to (state of previous, targets) where their rows are the same up
+        #to the shift and goto targets, mapped by targets, and the production Ids, mapped by
+        #idmap. Those rows are not packed again and keep their base, the columns of previous
+        #stay as they are and new symbols get columns after them
+        present = set([sym for row in table for sym in row])
+        symbols = sorted(present)
+        if previous is not None:
+            #symbols gone from the grammar keep their columns, but no row has cells in them and
+            #they are no terminals, so a token of one is an error before any default reduction
+            old = set(previous.symbols)
+            symbols = list(previous.symbols) + [sym for sym in symbols if not sym in old]
+        else:
+            reused = {}
+        symindex = dict([(sym, i) for i, sym in enumerate(symbols)])
+
+        rows = []
+        default = array('i', [0] * len(table))
+        #nonterminal columns only ever hold gotos
+        terms = set() if previous is None else set(previous.terminals) & present
+        for s, row in enumerate(table):
+            if s in reused:
+                o, targets = reused[s]
+                d = previous.default[o]
+                default[s] = -(idmap[-d - 1] + 1) if d else 0
+                rows.append(tuple([(c, targets[v] if v > 0 else -(idmap[-v - 1] + 1) if v else 0) for c, v in previous.rows[o]]))
+                continue
+            counts = {}
+            for a in row.values():
+                if a.action == SRG.REDUCE and a.number:
+                    counts[a.number] = counts.get(a.number, 0) + 1
+            if counts:
+                Id = max(counts, key = lambda x: (counts[x], -x))
+                default[s] = -(Id + 1)
+            packed = []
+            for sym, a in row.items():
+                if not a.action == SRG.GOTO:
+                    terms.add(sym)
+                if a.action == SRG.REDUCE:
+                    if -(a.number + 1) == default[s]:
+                        continue
+                    packed.append((symindex[sym], -(a.number + 1)))
+                elif a.action == SRG.ERROR:
+                    packed.append((symindex[sym], 0))
+                else:
+                    packed.append((symindex[sym], a.number + 1))
+            rows.append(tuple(sorted(packed)))
+        terminals = tuple([sym for sym in symbols if sym in terms])
+
+        #place the densest rows first, identical rows share their base. occupied marks the used
+        #slots and a lookahead regex over it finds the first base where all of a row's columns
+        #are free, which keeps the first-fit search in C
+        base = array('i', [0] * len(table))
+        check = array('i', [-1] * 2 * len(symbols))
+        value = array('i', [0] * 2 * len(symbols))
+        occupied = bytearray(2 * len(symbols))
+        placed = {}
+        used = set()
+        fresh = []
+        for s in range(len(rows)):
+            if not s in reused:
+                fresh.append(s)
+                continue
+            #rows of previous kept their columns, so their slots are free unless two rows of it
+            #shared a base and differ now
+            row = rows[s]
+            b = previous.base[reused[s][0]]
+            if row in placed:
+                base[s] = placed[row]
+                continue
+            if b in used:
+                fresh.append(s)
+                continue
+            grow = b + 2 * len(symbols) - len(check)
+            if grow > 0:
+                check.extend([-1] * grow)
+                value.extend([0] * grow)
+                occupied.extend(bytes(grow))
+            for c, v in row:
+                check[b + c] = c
+                value[b + c] = v
+                occupied[b + c] = 1
+            used.add(b)
+            placed[row] = b
+            base[s] = b
+
+        for s in sorted(fresh, key = lambda x: -len(rows[x])):
+            row = rows[s]
+            if row in placed:
+                base[s] = placed[row]
+                continue
+            pattern = b''
+            last = 0
+            for c, v in row:
+                pattern += b'.{%d}\\x00' % (c - last)
+                last = c + 1
+            pattern = re.compile(b'(?=' + pattern + b')', re.DOTALL)
+            b = 0
+            while True:
+                b = pattern.search(occupied, b).start()
+                if not b in used:
+                    break
+                b += 1
+            #keep a full row width of free slots past the last used one
+            grow = b + 2 * len(symbols) - len(check)
+            if grow > 0:
+                check.extend([-1] * grow)
+                value.extend([0] * grow)
+                occupied.extend(bytes(grow))
+            for c, v in row:
+                check[b + c] = c
+                value[b + c] = v
+                occupied[b + c] = 1
+            used.add(b)
+            placed[row] = b
+            base[s] = b
+
+        #base[s] + c only needs to stay within the arrays
+        del check[max(base, default = 0) + len(symbols):]
+        del value[max(base, default = 0) + len(symbols):]
+
+        compiled = CompiledTable(symbols, terminals, base, default, check, value)
+        compiled.rows = rows
+        return compiled
+
+#driver loop of the modules written by CLR_Parser.write_module, the same loop as
+#CLR_Parser.parse with the compiled table as module constants
+module_template = '''# Parser generated by clr.py, do not edit.
+# grammar hash: {hash}
+
+eol = {eol!r}
+
+class ParseError(Exception):
+    def __init__(self, message, token):
+        self.args = (message,)
+        self.token = token
+
+symbols = {symbols}
+
+terminals = {terminals}
+
+symindex = dict([(sym, i) for i, sym in enumerate(symbols)])
+
+termindex = dict([(sym, symindex[sym]) for sym in terminals])
+
+base = {base}
+
+default = {default}
+
+check = {check}
+
+value = {value}
+
+prodlhs = {prodlhs}
+
+prodlen = {prodlen}
+
+lhscol = {lhscol}
+
+bypassed = {bypassed}
+
+def parse(tokens, actions = None):
+    hooks = [None] * len(prodlen)
+    for Id in bypassed:
+        hooks[Id] = passthrough
+    if actions:
+        for Id, f in actions.items():
+            if Id in bypassed:
+                raise ValueError("Production {{}} is bypassed, it cannot have an action".format(Id))
+            hooks[Id] = f
+
+    size = 64
+    statestack = [0] * size
+    valuestack = [None] * size
+    sp = 0
+
+    tokens = iter(tokens)
+    tok = next(tokens, None)
+    col = termindex.get(eol if tok is None else tok.type, -1)
+
+    while True:
+        state = statestack[sp]
+        i = base[state] + col
+        act = value[i] if col >= 0 and check[i] == col else default[state]
+
+        if act > 0:
+            sp += 1
+            if sp == size:
+                statestack.extend([0] * size)
+                valuestack.extend([None] * size)
+                size *= 2
+            statestack[sp] = act - 1
+            valuestack[sp] = tok.value
+            tok = next(tokens, None)
+            col = termindex.get(eol if tok is None else tok.type, -1)
+            continue
+
+        if act == 0:
+            if tok is None:
+                raise ParseError("Unexpected end of input", None)
+            raise ParseError("Unexpected token {{}} at index {{}}".format(tok.type, tok.lexpos), tok)
+
+        Id = -act - 1
+        if Id == 0:
+            return valuestack[sp]
+
+        n = prodlen[Id]
+        values = valuestack[sp - n + 1:sp + 1]
+        sp -= n
+        f = hooks[Id]
+        result = f(values) if f else (prodlhs[Id], values)
+
+        sp += 1
+        if sp == size:
+            statestack.extend([0] * size)
+            valuestack.extend([None] * size)
+            size *= 2
+        statestack[sp] = value[base[statestack[sp - 1]] + lhscol[Id]] - 1
+        valuestack[sp] = result
+
+def passthrough(values):
+    return values[0]
+'''
+
+def passthrough(values):
+    #the action of bypassed unit productions
+    return values[0]
+
+def format_tuple(values):
+    #tuple literal wrapped at 16 items per line; tuples of constants are stored as a single
+    #constant in the bytecode cache
+    values = [repr(v) for v in values]
+    if len(values) == 1:
+        return "(" + values[0] + ",)"
+    lines = [", ".join(values[i:i + 16]) for i in range(0, len(values), 16)]
+    return "(\n    " + ",\n    ".join(lines) + ",\n)" if len(lines) > 1 else "(" + "".join(lines) + ")"
+
 class TempParserInternals:
     def __init__(self):
         self.terminals = set()
@@ -27,12 +301,264 @@ class TempParserInternals:
         self.firsts = {}
         self.stateid = 0
         self.table = []
+        self.kernels_built = 0
+        self.kernels_reused = 0
+
+        #compact item representation: an item core is (production Id << dotbits) | dot and
+        #lookaheads are bitsets over the interned terminals in termlist
+        self.prodlhs = []
+        self.prodrhs = []
+        self.dotbits = 0
+        self.termlist = []
+        self.termbit = {}
+        self.betafirst = {}
+        self.analysis = None
+        self.lhsprods = {}
+        self.ntclosure = {}
+        self.closures = {}
+        self.closures_computed = 0
+        self.closure_hits = 0
+        self.items_created = 0
+        self.closure_time = 0
+
+        #set up by reuse: the internals of a previous build, the production Ids and item cores
+        #of its unchanged productions mapped to the ones here, the cores of items whose closure
+        #may have changed, and its states by their kernel in the cores here
+        self.previous = None
+        self.idmap = {}
+        self.coremap = {}
+        self.badcores = set()
+        self.previous_kernels = {}
+        self.previous_keys = {}
+        self.states_reused = 0
+
+        #with profile set, the peak memory of the state construction is split like its time:
+        #closure_peak is the most the closures computed so far held at once, including the
+        #one being computed, and goto_peak the most the rest held, both above profile_base
+        self.profile = False
+        self.profile_base = 0
+        self.closure_memory = 0
+        self.closure_peak = 0
+        self.goto_peak = 0
+        self.states_peak = 0
+
+    def intern(self, startsymbol):
+        self.prodlhs = ['S\''] + [None] * len(self.productions)
+        self.prodrhs = [(startsymbol,)] + [None] * len(self.productions)
+        for p in self.productions:
+            self.prodlhs[p.Id] = p.lhs
+            self.prodrhs[p.Id] = tuple([r for r in p.rhs if not r == epsilon])
+        self.dotbits = max([len(rhs) for rhs in self.prodrhs]).bit_length()
+
+        self.termlist = self.analysis.termlist
+        self.termbit = self.analysis.termbit
+
+        #betafirst maps the core of an item A -> α • X β to (FIRST(β), β nullable), so that
+        #FIRST(β a) for lookahead a is a lookup and a union for every state sharing the item
+        self.betafirst = {}
+        for Id, rhs in enumerate(self.prodrhs):
+            bits = 0
+            nullable = True
+            for dot in range(len(rhs) - 1, -1, -1):
+                self.betafirst[Id << self.dotbits | dot] = (bits, nullable)
+                X = rhs[dot]
+                bits = self.analysis.first[X] | (bits if X in self.analysis.nullable else 0)
+                nullable = nullable and X in self.analysis.nullable
+
+        self.lhsprods = dict([(nt, []) for nt in self.nonterminals])
+        for p in self.productions:
+            self.lhsprods[p.lhs].append(p.Id)
+
+        #ntclosure maps a nonterminal B to the nonterminals C whose productions enter the
+        #closure of an item with B after the dot, as (C, spontaneous lookaheads, propagates),
+        #where propagates means C also receives the lookaheads following B
+        self.ntclosure = {}
+        for B in self.nonterminals:
+            la = {B: 0}
+            prop = {B: True}
+            work = [B]
+            while work:
+                C = work.pop()
+                for Id in self.lhsprods[C]:
+                    rhs = self.prodrhs[Id]
+                    if not rhs or not rhs[0] in self.nonterminals:
+                        continue
+                    D = rhs[0]
+                    bits, nullable = self.betafirst[Id << self.dotbits]
+                    newla = la.get(D, 0) | bits | (la[C] if nullable else 0)
+                    newprop = prop.get(D, False) or (nullable and prop[C])
+                    if not D in la or not newla == la[D] or not newprop == prop[D]:
+                        la[D] = newla
+                        prop[D] = newprop
+                        work.append(D)
+            self.ntclosure[B] = [(C, la[C], prop[C]) for C in la]
+
+    def closure(self, kernel):
+        if kernel in self.closures:
+            self.closure_hits += 1
+            return self.closures[kernel]
+
+        start = time.perf_counter()
+        if self.profile:
+            self.profile_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        items = dict(kernel)
+        prodrhs = self.prodrhs
+        dotbits = self.dotbits
+        dotmask = (1 << dotbits) - 1
+        nonterminals = self.nonterminals
+        betafirst = self.betafirst
+        ntclosure = self.ntclosure
+
+        ntla = {}
+        for core, la in kernel:
+            rhs = prodrhs[core >> dotbits]
+            dot = core & dotmask
+            if dot >= len(rhs) or not rhs[dot] in nonterminals:
+                continue
+            bits, nullable = betafirst[core]
+            follow = bits | la if nullable else bits
+            for C, spont, prop in ntclosure[rhs[dot]]:
+                ntla[C] = ntla.get(C, 0) | spont | (follow if prop else 0)
+
+        for C, la in ntla.items():
+            for Id in self.lhsprods[C]:
+                c = Id << dotbits
+                items[c] = items.get(c, 0) | la
+
+        self.closures[kernel] = items
+        self.closures_computed += 1
+        self.items_created += len(items)
+        self.closure_time += time.perf_counter() - start
+        if self.profile:
+            current, peak = tracemalloc.get_traced_memory()
+            self.closure_peak = max(self.closure_peak, self.closure_memory + peak - memory)
+            self.states_peak = max(self.states_peak, peak - self.profile_base)
+            self.closure_memory += current - memory
+            tracemalloc.reset_peak()
+        return items
+
+    def profile_peak(self):
+        #accounts the peak traced since the last closure to goto_peak and restarts tracing it
+        peak = tracemalloc.get_traced_memory()[1] - self.profile_base
+        self.goto_peak = max(self.goto_peak, peak - self.closure_memory)
+        self.states_peak = max(self.states_peak, peak)
+        tracemalloc.reset_peak()
+
+    def transitions(self, items):
+        #maps each symbol after a dot to the kernel reached by shifting it, in item order
+        prodrhs = self.prodrhs
+        dotbits = self.dotbits
+        dotmask = (1 << dotbits) - 1
+        nexts = {}
+        for core in sorted(items):
+            rhs = prodrhs[core >> dotbits]
+            dot = core & dotmask
+            if dot < len(rhs):
+                nexts.setdefault(rhs[dot], {})[core + 1] = items[core]
+        return nexts
+
+    def reuse(self, old, changed):
+        #prepares reusing the states of old, the internals of a build for an earlier version of
+        #the grammar, given the nonterminals whose rules changed since. A state of old is reused
+        #if no item of it belongs to a changed nonterminal or has an affected one after its
+        #dot or a symbol whose FIRST set or nullability changed behind that: its closure,
+        #transitions and reductions are then the same up to production Ids. Ids are mapped by
+        #lhs, rhs and %prec and must keep their order, so that items sort as before and the
+        #states are numbered as a full build numbers them
+        if not old.termlist == self.termlist:
+            return
+        newIds = {}
+        for p in self.productions:
+            if not p.lhs in changed:
+                newIds.setdefault((p.lhs, tuple(p.rhs), p.prec), []).append(p.Id)
+        idmap = {0: 0}
+        for p in old.productions:
+            Ids = newIds.get((p.lhs, tuple(p.rhs), p.prec))
+            if Ids:
+                idmap[p.Id] = Ids.pop(0)
+        kept = sorted(idmap)
+        if not [idmap[Id] for Id in kept] == sorted(idmap.values()):
+            return
+
+        new = self.analysis
+        prev = old.analysis
+        affected = new.affected(changed)
+        changedfirst = set([nt for nt in self.nonterminals if not nt in prev.first or
+            not new.first[nt] == prev.first[nt] or not (nt in new.nullable) == (nt in prev.nullable)])
+
+        for Id, rhs in enumerate(old.prodrhs):
+            for dot in range(len(rhs) + 1):
+                core = Id << old.dotbits | dot
+                if not Id in idmap or dot < len(rhs) and (rhs[dot] in affected or not changedfirst.isdisjoint(rhs[dot + 1:])):
+                    self.badcores.add(core)
+                if Id in idmap:
+                    self.coremap[core] = idmap[Id] << self.dotbits | dot
+
+        coremap = self.coremap
+        for state in old.states:
+            if all([core in coremap for core, la in state.kernel]):
+                key = tuple([(coremap[core], la) for core, la in state.kernel])
+                self.previous_kernels[key] = state
+                self.previous_keys[state.id] = key
+        self.previous = old
+        self.idmap = idmap
+
+    def previous_state(self, key):
+        #the state of the previous build with this kernel, if it can be reused
+        state = self.previous_kernels.get(key)
+        if state is None or not state.items.keys().isdisjoint(self.badcores):
+            return None
+        return state
+
+    def new_state(self, key):
+        #a state for a kernel, copied from the previous build where it can be reused
+        previous = self.previous_state(key) if self.previous_kernels else None
+        if previous is None:
+            return CLR_State(self, key)
+        self.states_reused += 1
+        coremap = self.coremap
+        return CLR_State(self, key, dict([(coremap[core], la) for core, la in previous.items.items()]), previous)
+
+    def previous_transitions(self, state):
+        #the transitions of a reused state of the previous build as kernel keys here. The kernels
+        #reached are its items with the dot moved, whose productions are all kept, so they are
+        #all in previous_keys
+        return [(sym, self.previous_keys[targetId]) for sym, targetId in state.gotos.items()]
+
+    def compact(self):
+        #a copy holding only what closure and transitions need, small enough to send to workers
+        pi = TempParserInternals()
+        pi.nonterminals = self.nonterminals
+        pi.prodrhs = self.prodrhs
+        pi.dotbits = self.dotbits
+        pi.betafirst = self.betafirst
+        pi.lhsprods = self.lhsprods
+        pi.ntclosure = self.ntclosure
+        return pi
+
+    def bits_to_terms(self, bits):
+        terms = []
+        i = 0
+        while bits:
+            if bits & 1:
+                terms.append(self.termlist[i])
+            bits >>= 1
+            i += 1
+        return terms
+
+    def item_to_LR1(self, core, la):
+        Id = core >> self.dotbits
+        return LR1_Prod(self.prodlhs[Id], self.prodrhs[Id], Id, set(self.bits_to_terms(la)), core & ((1 << self.dotbits) - 1))
 
 class Production:
-    def __init__(self, lhs, rhs, Id):
+    def __init__(self, lhs, rhs, Id, prec = None):
+        #prec is the symbol named by %prec, whose precedence the production takes instead of
+        #the precedence of its rightmost terminal
         self.lhs = lhs
         self.rhs = rhs
         self.Id = Id
+        self.prec = prec
 
     def to_LR1(self):
         return LR1_Prod(self.lhs, self.rhs, self.Id, set(), 0)
@@ -89,224 +615,1050 @@ class LR1_Prod(Production):
         return h
 
 class CLR_State:
-    def __init__(self, pi, lr1_prods):
-        self.lr1_prods = set()
+    def __init__(self, pi, kernel, items = None, previous = None):
+        #kernel is a kernel key as built by kernel_key, items maps item cores to lookahead bitsets
+        #and is shared with the closure cache, so it must not be modified. items is only passed
+        #in when the closure was computed elsewhere, as by the workers of build_parallel, or
+        #copied from previous, the equal state of an earlier build whose table row is reused
+        self.pi = pi
+        self.kernel = kernel
+        self.items = pi.closure(kernel) if items is None else items
         self.id = pi.stateid
+        self.gotos = {}
+        self.previous = previous
+        #kernels merged into this state, used to tell conflicts introduced by merging
+        self.sources = {kernel}
+        #the conflicts of its table row and the number of them precedence resolved
+        self.conflicts = []
+        self.resolved = 0
 
-        currSymbols = set()
-        finSymbols = set()
-        for p in lr1_prods:
-            self.lr1_prods |= {p}
-            if p.dot >= len(p.rhs):
-                continue
-            symbol = p.rhs[p.dot]
-            if p in finSymbols:
-                continue
+    @staticmethod
+    def kernel_key(kernel):
+        return tuple(sorted(kernel.items()))
+
+    @property
+    def lr1_prods(self):
+        return set([self.pi.item_to_LR1(core, la) for core, la in self.items.items()])
 
-            currSymbols.add(p)
-            finSymbols.add(p)
-
-        while currSymbols:
-            currSym = currSymbols.pop()
-            for prod in [p for p in pi.productions if p.lhs in currSym.next(0)]:
-                temp = prod.to_LR1()
-                for s in currSym.next(1):
-                    temp.la |= pi.firsts[s]
-                for lah in [x for x in self.lr1_prods if temp.canBeMerged(x)]:
-                    temp.la |= lah.la
-                    self.lr1_prods.discard(lah)
-                self.lr1_prods.add(temp)
-                if not temp in finSymbols:
-                    if temp.lhs in pi.nonterminals:
-                        finSymbols.add(temp)
-                        currSymbols.add(temp)
+    def transitions(self):
+        return self.pi.transitions(self.items)
 
     def getNextProds(self, nextSymbol):
-        temp = [copy.deepcopy(p) for p in self.lr1_prods if nextSymbol in p.next(0) and not p.dot == len(p.rhs)]
-        for p in temp:
-            p.dot += 1
-        return temp
+        return self.transitions().get(nextSymbol, {})
 
     def reduceSet(self):
-        prods = [p for p in self.lr1_prods if p.final()]
-        return prods
+        prodrhs = self.pi.prodrhs
+        dotbits = self.pi.dotbits
+        dotmask = (1 << dotbits) - 1
+        return [(core >> dotbits, la) for core, la in sorted(self.items.items()) if core & dotmask == len(prodrhs[core >> dotbits])]
+
+    def merge_introduced(self, Id1, Id2, sym):
+        pi = self.pi
+        bit = pi.termbit[sym]
+        c1 = Id1 << pi.dotbits | len(pi.prodrhs[Id1])
+        c2 = Id2 << pi.dotbits | len(pi.prodrhs[Id2])
+        for source in self.sources:
+            items = pi.closure(source)
+            if items.get(c1, 0) & bit and items.get(c2, 0) & bit:
+                return False
+        return True
 
     def __eq__(self, other):
         if not isinstance(other, CLR_State):
             return False
-        if not len(self.lr1_prods) == len(other.lr1_prods):
-            return False
-        if not self.lr1_prods >= other.lr1_prods:
-            return False
-        return True
+        return self.items == other.items
 
     def __str__(self):
         return "State {}:\n\n".format(self.id) + "\n".join(map(str, self.lr1_prods))
 
-class CLR_Parser:
-    def __init__(self, grammar, startsymbol, terminals):
-        terminals |= {epsilon}
+def build_canonical(pi):
+    #states that can be reused from a previous build take their transitions from it
+    states = [pi.new_state(CLR_State.kernel_key({0: pi.termbit[eol]}))]
+    statemap = {states[0].kernel: states[0]}
+    pi.kernels_built = 1
+    pi.kernels_reused = 0
+
+    pi.stateid += 1
+
+    counter = 0
+
+    while counter < len(states):
+        state = states[counter]
+        if state.previous is None:
+            nexts = [(sym, CLR_State.kernel_key(kernel)) for sym, kernel in state.transitions().items()]
+        else:
+            nexts = pi.previous_transitions(state.previous)
+        for sym, key in nexts:
+            existing = statemap.get(key)
+            if existing is None:
+                existing = pi.new_state(key)
+                pi.stateid += 1
+                pi.kernels_built += 1
+                states.append(existing)
+                statemap[key] = existing
+            else:
+                pi.kernels_reused += 1
+            state.gotos[sym] = existing.id
+
+        counter += 1
+
+    return states
+
+#the compact parser internals of a worker process of build_parallel, set by the pool initializer
+expand_pi = None
+
+def init_expand_worker(pi):
+    global expand_pi
+    expand_pi = pi
+
+def expand_kernel(kernel):
+    #closure of a kernel and the kernel keys of its transitions, in the order of transitions().
+    #Every kernel is expanded only once, so the closure is not kept in the worker's cache
+    items = expand_pi.closure(kernel)
+    del expand_pi.closures[kernel]
+    return items, [(sym, CLR_State.kernel_key(k)) for sym, k in expand_pi.transitions(items).items()]
+
+def build_parallel(pi, workers):
+    #builds the same states in the same order as build_canonical, but the closures and gotos of
+    #every frontier of new kernels are computed by a pool of worker processes. The states are
+    #numbered here, going through the frontier in order, which is the breadth first order the
+    #serial loop visits them in, so the table does not depend on how the work was distributed
+    start = CLR_State.kernel_key({0: pi.termbit[eol]})
+    kernels = [start]
+    statemap = {start: 0}
+    states = []
+    pi.kernels_built = 1
+    pi.kernels_reused = 0
+
+    with multiprocessing.Pool(workers, init_expand_worker, (pi.compact(),)) as pool:
+        while len(states) < len(kernels):
+            frontier = kernels[len(states):]
+            start = time.perf_counter()
+            expanded = pool.map(expand_kernel, frontier, chunksize = max(1, len(frontier) // (workers * 4)))
+            pi.closure_time += time.perf_counter() - start
+
+            for kernel, (items, nexts) in zip(frontier, expanded):
+                pi.closures[kernel] = items
+                pi.closures_computed += 1
+                pi.items_created += len(items)
+                state = CLR_State(pi, kernel, items)
+                pi.stateid += 1
+                states.append(state)
+                for sym, key in nexts:
+                    targetId = statemap.get(key)
+                    if targetId is None:
+                        targetId = statemap[key] = len(kernels)
+                        kernels.append(key)
+                        pi.kernels_built += 1
+                    else:
+                        pi.kernels_reused += 1
+                    state.gotos[sym] = targetId
+
+    return states
+
+def weakly_compatible(kernel1, kernel2):
+    #Pager's weak compatibility of two kernels with equal cores: merging them cannot introduce
+    #a reduce-reduce conflict that neither of them has on its own
+    for i in range(len(kernel1)):
+        a1 = kernel1[i][1]
+        a2 = kernel2[i][1]
+        for j in range(i + 1, len(kernel1)):
+            b1 = kernel1[j][1]
+            b2 = kernel2[j][1]
+            if (a1 & b2 or a2 & b1) and not a1 & b1 and not a2 & b2:
+                return False
+    return True
+
+def build_merged(pi, compatible = None):
+    #states with equal item cores are merged by uniting their lookaheads, states whose
+    #lookaheads grew are processed again to propagate them to their successors. Without
+    #compatible every core gets a single state (LALR(1)), otherwise a kernel is only merged
+    #into a state for which compatible(state kernel, kernel) holds
+    states = [CLR_State(pi, CLR_State.kernel_key({0: pi.termbit[eol]}))]
+    coremap = {(0,): [states[0]]}
+    pi.kernels_built = 1
+    pi.kernels_reused = 0
+
+    pi.stateid += 1
+
+    work = [states[0]]
+    queued = {states[0].id}
+
+    while work:
+        state = work.pop(0)
+        queued.discard(state.id)
+        for sym, kernel in state.transitions().items():
+            key = CLR_State.kernel_key(kernel)
+            candidates = coremap.setdefault(tuple([c for c, la in key]), [])
+            existing = None
+            for candidate in candidates:
+                if key in candidate.sources or compatible is None or compatible(candidate.kernel, key):
+                    existing = candidate
+                    break
+            if existing is None:
+                existing = CLR_State(pi, key)
+                pi.stateid += 1
+                pi.kernels_built += 1
+                states.append(existing)
+                candidates.append(existing)
+                work.append(existing)
+                queued.add(existing.id)
+            elif not key in existing.sources:
+                pi.kernels_reused += 1
+                merged = CLR_State.kernel_key(dict([(c, la | kernel[c]) for c, la in existing.kernel]))
+                existing.sources.add(key)
+                if not merged == existing.kernel:
+                    existing.kernel = merged
+                    existing.items = pi.closure(merged)
+                    if not existing.id in queued:
+                        work.append(existing)
+                        queued.add(existing.id)
+            else:
+                pi.kernels_reused += 1
+            state.gotos[sym] = existing.id
+
+    #a state whose lookaheads grew may have been redirected to a different successor,
+    #leaving the old one unreachable
+    reachable = {0}
+    work = [states[0]]
+    while work:
+        for targetId in work.pop().gotos.values():
+            if not targetId in reachable:
+                reachable.add(targetId)
+                work.append(states[targetId])
+    if len(reachable) < len(states):
+        states = [s for s in states if s.id in reachable]
+        renumber = dict([(s.id, i) for i, s in enumerate(states)])
+        for s in states:
+            s.id = renumber[s.id]
+            s.gotos = dict([(sym, renumber[t]) for sym, t in s.gotos.items()])
+        pi.stateid = len(states)
+
+    return states
+
+def read_grammar(grammar, terminals):
+    #returns the productions of a grammar string, with Ids counting from 1 in the order they
+    #are written, and the set of nonterminals. An option may end in %prec followed by a symbol
+    productions = []
+    nonterminals = set()
+
+    ProdId = 1
+    for line in grammar.splitlines():
+        if not line.strip():
+            continue
+        arrow = line.split('->')
+        lhs = arrow[0].strip()
+        nonterminals |= {lhs}
+        for option in arrow[1].split('|'):
+            rhs = [x.strip() for x in option.split()]
+            prec = None
+            if '%prec' in rhs:
+                i = rhs.index('%prec')
+                if not i == len(rhs) - 2:
+                    raise ValueError("%prec must be followed by exactly one symbol in {!r}".format(line.strip()))
+                prec = rhs[i + 1]
+                rhs = rhs[:i]
+            nonterminals |= set(rhs)
+            productions.append(Production(lhs, rhs, ProdId, prec))
+            ProdId += 1
+
+    return productions, nonterminals - terminals
+
+def patch_grammar(grammar, changes):
+    #replaces all rules of every nonterminal on a left hand side in changes by the lines for it
+    #there, at the place of its first line in grammar. Nonterminals new to grammar are appended
+    replaced = {}
+    for line in changes.splitlines():
+        if line.strip():
+            replaced.setdefault(line.split('->')[0].strip(), []).append(line.strip())
+
+    lines = []
+    for line in grammar.splitlines():
+        if not line.strip():
+            continue
+        lhs = line.split('->')[0].strip()
+        if not lhs in replaced:
+            lines.append(line.strip())
+        elif replaced[lhs]:
+            lines += replaced[lhs]
+            replaced[lhs] = []
+    for rules in replaced.values():
+        lines += rules
+    return "\n".join(lines)
+
+def precedence_levels(precedence):
+    #maps every symbol of a yacc style precedence list, lowest precedence first, such as
+    #[('left', '+', '-'), ('left', '*', '/'), ('right', '^')], to (level, associativity)
+    levels = {}
+    for level, (assoc, *symbols) in enumerate(precedence, 1):
+        if not assoc in ('left', 'right', 'nonassoc'):
+            raise ValueError("Undefined associativity {!r}".format(assoc))
+        for sym in symbols:
+            if sym in levels:
+                raise ValueError("Precedence for {!r} declared twice".format(sym))
+            levels[sym] = (level, assoc)
+    return levels
+
+def resolve_shift_reduce(levels, production, sym, terminals):
+    #yacc's resolution of a conflict between shifting sym and reducing by production: the
+    #higher precedence wins, on equal precedence the associativity decides. Returns the kept
+    #action, SRG.ERROR for nonassoc, or None if the production or sym has no precedence
+    prec = production.prec
+    if prec is None:
+        rhsterms = [r for r in production.rhs if r in terminals and not r == epsilon]
+        prec = rhsterms[-1] if rhsterms else None
+    if not prec in levels or not sym in levels:
+        return None
+    prodlevel = levels[prec][0]
+    symlevel, assoc = levels[sym]
+    if prodlevel > symlevel or prodlevel == symlevel and assoc == 'left':
+        return SRG.REDUCE
+    if prodlevel < symlevel or assoc == 'right':
+        return SRG.SHIFT
+    return SRG.ERROR
+
+def changed_rules(old, new):
+    #returns the nonterminals whose productions differ between two lists of Productions
+    rules = {}
+    for p in old:
+        rules.setdefault(p.lhs, []).append((tuple(p.rhs), p.prec or ''))
+    newrules = {}
+    for p in new:
+        newrules.setdefault(p.lhs, []).append((tuple(p.rhs), p.prec or ''))
+    return set([A for A in rules.keys() | newrules.keys() if not sorted(rules.get(A, [])) == sorted(newrules.get(A, []))])
+
+class GrammarAnalysis:
+    #nullable, FIRST and FOLLOW sets of a list of Productions. FIRST and FOLLOW sets are bitsets
+    #over termlist and are computed by worklists over the symbol dependencies, so a symbol is
+    #only revisited when a set it depends on grew. epsilon in a rhs stands for the empty
+    #sequence, nullability is kept in the nullable set instead of in the FIRST sets.
+    #Given the analysis of a previous version of the grammar and the nonterminals whose rules
+    #changed since, nullable and FIRST are only recomputed for the nonterminals affected
+    def __init__(self, productions, startsymbol, terminals, previous = None, changed = ()):
+        self.startsymbol = startsymbol
+        self.terminals = set(terminals) | {eol}
+        self.termlist = sorted(self.terminals)
+        self.termbit = dict([(t, 1 << i) for i, t in enumerate(self.termlist)])
+
+        self.productions = [(p.lhs, tuple([r for r in p.rhs if not r == epsilon])) for p in productions]
+        self.nonterminals = set([lhs for lhs, rhs in self.productions])
+        for lhs, rhs in self.productions:
+            self.nonterminals |= set([r for r in rhs if not r in self.terminals])
+
+        self.nullable = set()
+        self.first = {}
+        self.follow = {}
+        scope = None
+        if previous is not None and previous.termlist == self.termlist:
+            scope = self.affected(set(changed) | (self.nonterminals - set(previous.first)))
+            self.nullable = (previous.nullable & self.nonterminals) - scope
+            self.first = dict([(nt, previous.first[nt]) for nt in self.nonterminals - scope])
+        self.calc_nullable(scope)
+        self.calc_first(scope)
+        self.calc_follow()
+
+    def affected(self, changed):
+        #the nonterminals with a changed one in the rules of a nonterminal reachable from them,
+        #only their nullability, FIRST sets and closures can differ from before the change
+        users = dict([(nt, set()) for nt in self.nonterminals])
+        for lhs, rhs in self.productions:
+            for r in rhs:
+                if r in self.nonterminals:
+                    users[r].add(lhs)
+        affected = set(changed) & self.nonterminals
+        work = list(affected)
+        while work:
+            for A in users[work.pop()]:
+                if not A in affected:
+                    affected.add(A)
+                    work.append(A)
+        return affected
+
+    def calc_nullable(self, scope = None):
+        #remaining counts the rhs symbols of each production not yet known to be nullable. With
+        #a scope only the productions of its nonterminals are looked at, the others are known
+        remaining = []
+        occurs = dict([(nt, []) for nt in self.nonterminals])
+        work = []
+        for i, (lhs, rhs) in enumerate(self.productions):
+            remaining.append(0)
+            if scope is not None and not lhs in scope:
+                continue
+            for r in rhs:
+                if not r in self.nullable:
+                    remaining[i] += 1
+                    if r in self.nonterminals:
+                        occurs[r].append(i)
+            if not remaining[i]:
+                work.append(lhs)
+
+        while work:
+            A = work.pop()
+            if A in self.nullable:
+                continue
+            self.nullable.add(A)
+            for i in occurs[A]:
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    work.append(self.productions[i][0])
+
+    def calc_first(self, scope = None):
+        first = dict(self.termbit)
+        for nt in self.nonterminals:
+            first[nt] = 0 if scope is None or nt in scope else self.first[nt]
+
+        #FIRST(A) contains FIRST(X) for every A in users[X]
+        users = dict([(nt, set()) for nt in self.nonterminals])
+        for lhs, rhs in self.productions:
+            if scope is not None and not lhs in scope:
+                continue
+            for X in rhs:
+                if X in self.terminals:
+                    first[lhs] |= self.termbit[X]
+                    break
+                users[X].add(lhs)
+                if not X in self.nullable:
+                    break
 
-        #calc productions
-        pi = TempParserInternals()
+        work = [nt for nt in self.nonterminals if first[nt]]
+        while work:
+            X = work.pop()
+            for A in users[X]:
+                if not first[A] | first[X] == first[A]:
+                    first[A] |= first[X]
+                    work.append(A)
+
+        self.first = first
+
+    def calc_follow(self):
+        follow = dict([(nt, 0) for nt in self.nonterminals])
+        if self.startsymbol in follow:
+            follow[self.startsymbol] = self.termbit[eol]
+
+        #FOLLOW(B) contains FOLLOW(A) for every B in users[A]
+        users = dict([(nt, set()) for nt in self.nonterminals])
+        for lhs, rhs in self.productions:
+            bits = 0
+            nullable = True
+            for B in reversed(rhs):
+                if B in self.nonterminals:
+                    follow[B] |= bits
+                    if nullable:
+                        users[lhs].add(B)
+                bits = self.first[B] | (bits if B in self.nullable else 0)
+                nullable = nullable and B in self.nullable
+
+        work = [nt for nt in self.nonterminals if follow[nt]]
+        while work:
+            A = work.pop()
+            for B in users[A]:
+                if not follow[B] | follow[A] == follow[B]:
+                    follow[B] |= follow[A]
+                    work.append(B)
+
+        self.follow = follow
+
+    def first_of(self, symbols):
+        #returns the FIRST bitset of a sequence of symbols and whether it is nullable
+        bits = 0
+        for X in symbols:
+            bits |= self.first[X]
+            if not X in self.nullable:
+                return bits, False
+        return bits, True
+
+    def terms(self, bits):
+        return [t for i, t in enumerate(self.termlist) if bits >> i & 1]
+
+    def first_set(self, sym):
+        return self.terms(self.first[sym])
+
+    def follow_set(self, sym):
+        return self.terms(self.follow[sym])
+
+def grammar_hash(grammar, startsymbol, terminals, mode, precedence = ()):
+    key = repr((tabversion, grammar, startsymbol, sorted(terminals), mode, [tuple(level) for level in precedence]))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class Conflict:
+    #a conflict found while filling the table. Shift-reduce conflicts keep the shift and rules
+    #holds the dropped reduction, reduce-reduce conflicts keep the later of the two rules.
+    #merged tells a reduce-reduce conflict that only exists because states were merged
+    def __init__(self, kind, state, symbol, rules, merged = False):
+        self.kind = kind
+        self.state = state
+        self.symbol = symbol
+        self.rules = rules
+        self.merged = merged
 
-        print("Startsymbol: {}\n".format(startsymbol))
+    def __str__(self):
+        if self.kind == 'shift-reduce':
+            return "Shift-Reduce conflict in state {} for symbol {}".format(self.state, self.symbol)
+        retstr = "Reduce-reduce conflict in state {} for rules {} and {} with symbol {}".format(self.state, self.rules[0], self.rules[1], self.symbol)
+        if self.merged:
+            retstr += "\n    introduced by merging states with equal cores"
+        return retstr
+
+class BuildReport:
+    #everything CLR_Parser found while building its table. Nothing is formatted until the
+    #report is converted to a string or written to a file
+    def __init__(self):
+        self.startsymbol = None
+        self.mode = None
+        self.cachefile = None
+        self.terminals = set()
+        self.nonterminals = set()
+        self.productions = []
+        self.firsts = {}
+        self.follows = {}
+        self.states = []
+        self.table = []
+        self.conflicts = []
+        self.timings = {}
+        self.peaks = {}
+        self.sizes = {}
+        self.counts = {}
+        self.profile = False
+
+    def begin(self):
+        #starts timing a phase, with profile set also its peak memory above the current use
+        if self.profile:
+            tracemalloc.reset_peak()
+            return time.perf_counter(), tracemalloc.get_traced_memory()[0]
+        return time.perf_counter(), 0
+
+    def end(self, name, phase):
+        start, current = phase
+        self.timings[name] = time.perf_counter() - start
+        if self.profile:
+            self.peaks[name] = tracemalloc.get_traced_memory()[1] - current
 
-        ProdId = 1
-        for line in grammar.splitlines():
-            arrow = line.split('->')
-            lhs = arrow[0].strip()
-            pi.nonterminals |= {lhs}
-            for option in arrow[1].split('|'):
-                rhs = [x.strip() for x in option.split()]
-                pi.nonterminals |= set(rhs)
-                pi.productions.append(Production(lhs, rhs, ProdId))
-                ProdId += 1
+    def __str__(self):
+        lines = []
+        if self.cachefile is not None:
+            lines.append("Loaded table from {}\n".format(self.cachefile))
+            lines.extend(map(str, self.conflicts))
+        else:
+            lines.append("Startsymbol: {}\n".format(self.startsymbol))
+            lines.append("Terminals:  {} \n".format(self.terminals))
+            lines.append("Nonterminals:  {} \n".format(self.nonterminals))
+            lines.append("Grammar:\n")
+            lines.extend(map(str, self.productions))
+
+            lines.append("\nFirst-Sets:\n")
+            for k, v in [p for p in self.firsts.items() if not p[0] in self.terminals]:
+                lines.append("First({}): {}".format(k, v))
+
+            lines.append("\nFollow-Sets:\n")
+            for k in sorted(self.follows):
+                lines.append("Follow({}): {}".format(k, self.follows[k]))
+
+            lines.append("\nStates:\n")
+            lines.extend(map(str, self.conflicts))
+            for s in self.states:
+                lines.append("{} \n".format(s))
+
+        lines.append("\nTable:\n")
+        for k in range(0, len(self.table)):
+            lines.append("{} {}".format(k, self.table[k]))
+
+        lines.append("")
+        return "\n".join(lines) + "\n" + self.summary()
+
+    def summary(self):
+        lines = ["Sizes: {}".format(", ".join(["{} {}".format(k, v) for k, v in self.sizes.items()]))]
+        if self.counts:
+            lines.append("Counts: {}".format(", ".join(["{} {}".format(k, v) for k, v in self.counts.items()])))
+        if self.timings:
+            lines.append("Timings: {}".format(", ".join(["{} {:.6f}s".format(k, v) for k, v in self.timings.items()])))
+        if self.peaks:
+            lines.append("Peak memory: {}".format(", ".join(["{} {}kB".format(k, v // 1024) for k, v in self.peaks.items()])))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            f.write(str(self))
 
-        pi.nonterminals -= terminals
+class CLR_Parser:
+    def __init__(self, grammar, startsymbol, terminals, mode = 'clr', cachedir = None, verbose = False, profile = False, workers = None, previous = None, precedence = ()):
+        #mode selects the table construction: 'clr' for canonical LR(1), 'lalr' for LALR(1) and
+        #'pager' for minimal LR(1), which only keeps states apart where merging could conflict.
+        #Nothing is printed unless verbose is set, everything is collected in self.report.
+        #profile additionally traces the peak memory of every phase, which slows the build down.
+        #workers > 1 builds the canonical states in that many processes, giving the same table.
+        #previous is a parser built before for an earlier version of the grammar in the same mode,
+        #whose FIRST sets, states, table rows and compiled rows are reused where the rules
+        #changed since cannot have affected them, see TempParserInternals.reuse.
+        #precedence is a yacc style list of (associativity, symbols...) tuples, lowest first,
+        #used to resolve shift-reduce conflicts like yacc does
+        if not mode in ('clr', 'lalr', 'pager'):
+            raise ValueError("Undefined mode {!r}".format(mode))
+        if workers is not None and workers > 1 and not mode == 'clr':
+            raise ValueError("Parallel construction needs mode 'clr', not {!r}".format(mode))
 
-        pi.terminals = terminals
+        terminals |= {epsilon}
 
-        print("Terminals: ", pi.terminals, "\n")
+        self.grammar = grammar
+        self.startsymbol = startsymbol
+        self.terminals = terminals
+        self.mode = mode
+        self.precedence = precedence
+        self.internals = None
+        self.bypassed = set()
+        self.grammar_hash = grammar_hash(grammar, startsymbol, terminals, mode, precedence)
+        self.report = report = BuildReport()
+        report.startsymbol = startsymbol
+        report.mode = mode
+
+        tracing = profile and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        report.profile = profile
+        try:
+            self.build(grammar, startsymbol, terminals, mode, cachedir, workers, previous)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+        if verbose:
+            print(report)
+
+    def build(self, grammar, startsymbol, terminals, mode, cachedir, workers = None, previous = None):
+        report = self.report
+
+        #with a cachedir, the table is stored in a file named by a hash of everything it is built from
+        cachefile = None
+        if cachedir is not None:
+            cachefile = os.path.join(cachedir, "clr-{}.pickle".format(self.grammar_hash))
+            if self.read_table(cachefile):
+                report.cachefile = cachefile
+                report.table = self.table
+                report.sizes = self.table_sizes()
+                return
 
-        print("Nonterminals: ", pi.nonterminals, "\n")
+        #calc productions
+        pi = TempParserInternals()
 
-        pi.productions = sorted(pi.productions, key = lambda x: (x.lhs, x.rhs))
+        phase = report.begin()
+        pi.productions, pi.nonterminals = read_grammar(grammar, terminals)
 
-        print("Grammar:\n")
-        for p in pi.productions:
-            print( p )
+        pi.terminals = terminals
 
+        pi.productions = sorted(pi.productions, key = lambda x: (x.lhs, x.rhs))
+        report.end('grammar', phase)
 
         #calc first sets
-        pi.firsts = dict([(x, {x} if x in pi.terminals else set()) for x in pi.terminals | pi.nonterminals])
-
-        pi.firsts[eol] = {eol}
-
-        for p in pi.productions:
-            counter = 0
-            while True:
-                currSym = p.rhs[counter]
-                if currSym in pi.terminals:
-                    pi.firsts[p.lhs].add(currSym)
-                if currSym is not epsilon:
-                    break
-
-                counter += 1
-                if counter >= len(p.rhs):
-                    break
-
-
-        eclipsable = set([x for x in pi.firsts.keys() if epsilon in pi.firsts[x]])
+        phase = report.begin()
+        old = None
+        if previous is not None and previous.mode == mode and previous.precedence == self.precedence:
+            old = previous.internals
+        if old is None:
+            pi.analysis = GrammarAnalysis(pi.productions, startsymbol, pi.terminals)
+        else:
+            changed = changed_rules(old.productions, pi.productions)
+            pi.analysis = GrammarAnalysis(pi.productions, startsymbol, pi.terminals, old.analysis, changed)
+
+        pi.firsts = {}
+        for sym in pi.terminals | pi.nonterminals | {eol}:
+            pi.firsts[sym] = set(pi.analysis.first_set(sym)) | ({epsilon} if sym in pi.analysis.nullable else set())
+        report.end('first', phase)
+
+        phase = report.begin()
+        pi.profile = report.profile
+        pi.profile_base = phase[1]
+        pi.intern(startsymbol)
+        if old is not None:
+            pi.reuse(old, changed)
+
+        parallel = mode == 'clr' and workers is not None and workers > 1
+        if parallel:
+            states = build_parallel(pi, workers)
+        elif mode == 'clr':
+            states = build_canonical(pi)
+        elif mode == 'lalr':
+            states = build_merged(pi)
+        else:
+            states = build_merged(pi, weakly_compatible)
+        if pi.previous is not None and (parallel or not mode == 'clr'):
+            #only the serial canonical construction reuses states, the others reuse their rows
+            for state in states:
+                state.previous = pi.previous_state(state.kernel)
+                pi.states_reused += state.previous is not None
+        if report.profile:
+            pi.profile_peak()
+        report.end('states', phase)
+        report.timings['closure'] = pi.closure_time
+        report.timings['goto'] = report.timings['states'] - pi.closure_time
+        if report.profile:
+            #closures restart tracing the peak, so it is taken from what they accounted
+            report.peaks['states'] = pi.states_peak
+            report.peaks['closure'] = pi.closure_peak
+            report.peaks['goto'] = pi.goto_peak
+
+        phase = report.begin()
+        levels = precedence_levels(self.precedence)
+        productions = dict([(p.Id, p) for p in pi.productions])
+        #reused rows take their reductions from the rows of the previous build, where optimize
+        #may only have redirected gotos
+        reductions = dict([(Id, Action(SRG.REDUCE, newId)) for Id, newId in pi.idmap.items()])
+        resolved = 0
+        for state in states:
+            currId = state.id
+            pi.table.append(dict())
+            for sym, targetId in state.gotos.items():
+                pi.table[currId][sym] = Action(SRG.SHIFT if sym in pi.terminals else SRG.GOTO, targetId)
+
+            if state.previous is not None:
+                row = pi.table[currId]
+                for s, a in pi.previous.table[state.previous.id].items():
+                    if a.action == SRG.REDUCE:
+                        row[s] = reductions[a.number]
+                    elif a.action == SRG.ERROR:
+                        row[s] = a
+                for c in state.previous.conflicts:
+                    rules = tuple([pi.idmap[Id] for Id in c.rules])
+                    merged = c.kind == 'reduce-reduce' and state.merge_introduced(rules[0], rules[1], c.symbol)
+                    state.conflicts.append(Conflict(c.kind, currId, c.symbol, rules, merged))
+                state.resolved = state.previous.resolved
+                report.conflicts.extend(state.conflicts)
+                resolved += state.resolved
+                continue
 
+            temp = state.reduceSet()
+            for Id, la in temp:
+                for s in pi.bits_to_terms(la):
+                    action = Action(SRG.REDUCE, Id)
+                    if s in state.gotos:
+                        kept = resolve_shift_reduce(levels, productions[Id], s, pi.terminals) if Id else None
+                        if kept is None:
+                            state.conflicts.append(Conflict('shift-reduce', currId, s, (Id,)))
+                            continue
+                        state.resolved += 1
+                        if kept == SRG.SHIFT:
+                            continue
+                        if kept == SRG.ERROR:
+                            action = Action(SRG.ERROR, 0)
+                    if s in pi.table[currId] and pi.table[currId][s].action == SRG.REDUCE:
+                        prev = pi.table[currId][s].number
+                        state.conflicts.append(Conflict('reduce-reduce', currId, s, (prev, Id), state.merge_introduced(prev, Id, s)))
+                    pi.table[currId][s] = action
+            report.conflicts.extend(state.conflicts)
+            resolved += state.resolved
+        report.end('table', phase)
 
-        while True:
-            updated = False
-
-            for prod in pi.productions:
-                broken = False
-                for rh in prod.rhs:
-                    if not all([p in pi.firsts[prod.lhs] for p in pi.firsts[rh] if not p == epsilon]):
-                        pi.firsts[prod.lhs] |= pi.firsts[rh] - { epsilon }
-                        updated = True
-                    if not rh in eclipsable:
-                        broken = True
+        self.table = pi.table
+        self.kernels_built = pi.kernels_built
+        self.kernels_reused = pi.kernels_reused
+        self.merge_conflicts = [(c.state, c.rules[0], c.rules[1], c.symbol) for c in report.conflicts if c.merged]
+
+        #production metadata indexed by production Id, used by the parse loop
+        self.prodlhs = pi.prodlhs
+        self.prodlen = [len(rhs) for rhs in pi.prodrhs]
+
+        phase = report.begin()
+        if pi.previous is None:
+            pi.compiled = CompiledTable.compile(self.table)
+        else:
+            #the shift and goto targets of a reused row map like the gotos of its state
+            reused = {}
+            for state in states:
+                if state.previous is not None:
+                    gotos = state.previous.gotos
+                    reused[state.id] = (state.previous.id, dict([(gotos[sym] + 1, t + 1) for sym, t in state.gotos.items()]))
+            pi.compiled = CompiledTable.compile(self.table, pi.previous.compiled, reused, pi.idmap)
+        self.compiled = pi.compiled
+        report.end('compile', phase)
+
+        report.terminals = pi.terminals
+        report.nonterminals = pi.nonterminals
+        report.productions = pi.productions
+        report.firsts = pi.firsts
+        report.follows = dict([(nt, set(pi.analysis.follow_set(nt))) for nt in pi.nonterminals])
+        report.states = states
+        report.table = self.table
+        report.sizes = self.table_sizes()
+        report.counts = {
+            'closures': pi.closures_computed,
+            'closure_hits': pi.closure_hits,
+            'items': pi.items_created,
+            'conflicts': len(report.conflicts),
+            'resolved': resolved,
+            'states_reused': pi.states_reused,
+        }
+
+        #keep what a rebuild reuses, but not the build before this one
+        pi.states = states
+        for state in states:
+            state.previous = None
+        pi.previous = None
+        pi.previous_kernels = {}
+        pi.previous_keys = {}
+        self.internals = pi
+
+        if cachefile is not None:
+            self.write_table(cachefile)
+
+    def rebuild(self, changes, verbose = False, profile = False, workers = None):
+        #returns a parser for this grammar with the rules of every nonterminal defined in the
+        #grammar string changes replaced by those, as patch_grammar does. Only what depends on
+        #the changed nonterminals is computed again, the table is the same as a full build's
+        return CLR_Parser(patch_grammar(self.grammar, changes), self.startsymbol, set(self.terminals), mode = self.mode,
+            verbose = verbose, profile = profile, workers = workers, previous = self, precedence = self.precedence)
+
+    def optimize(self, keep = ()):
+        #bypasses unit reductions: where the goto of a state on B leads to a state whose only
+        #action is reducing by a unit production A -> B, the goto is redirected to where that
+        #reduction would go, following chains like E -> T -> F. The value of B then stands for
+        #A, so the productions in keep, those with an action, are never bypassed. Bypassed
+        #productions still reduced elsewhere pass their value through too. States left
+        #unreachable are dropped. Rows with a single reduction already compile to a bare default
+        table = self.table
+
+        def unit(t):
+            actions = set([(a.action, a.number) for a in table[t].values()])
+            if not len(actions) == 1:
+                return None
+            action, Id = actions.pop()
+            if not action == SRG.REDUCE or Id == 0 or Id in keep or not self.prodlen[Id] == 1:
+                return None
+            return Id
+
+        for row in table:
+            for sym, a in list(row.items()):
+                if not a.action == SRG.GOTO:
+                    continue
+                target = a.number
+                seen = {target}
+                while True:
+                    Id = unit(target)
+                    if Id is None or not self.prodlhs[Id] in row or row[self.prodlhs[Id]].number in seen:
                         break
-                if not broken:
-                    eclipsable |= { prod.lhs }
-                    pi.firsts[prod.lhs] |= {epsilon}
-
-
-            if not updated:
-                break
-
-        print("\nFirst-Sets:\n")
-        for k, v in [p for p in pi.firsts.items() if not p[0] in pi.terminals]:
-            print("First({}): {}".format(k, v))
-
-
-
-        print("\nStates:\n")
+                    self.bypassed.add(Id)
+                    target = row[self.prodlhs[Id]].number
+                    seen.add(target)
+                row[sym] = Action(SRG.GOTO, target)
+
+        reachable = [0]
+        renumber = {0: 0}
+        for s in reachable:
+            for a in table[s].values():
+                if a.action in (SRG.SHIFT, SRG.GOTO) and not a.number in renumber:
+                    renumber[a.number] = len(reachable)
+                    reachable.append(a.number)
+        self.table = [dict([(sym, Action(a.action, renumber[a.number]) if a.action in (SRG.SHIFT, SRG.GOTO) else a)
+            for sym, a in table[s].items()]) for s in reachable]
+
+        self.compiled = CompiledTable.compile(self.table)
+        self.report.table = self.table
+        self.report.sizes = self.table_sizes()
+        return self
+
+    def table_sizes(self):
+        return {
+            'states': len(self.table),
+            'cells': sum([len(row) for row in self.table]),
+            'compiled': len(self.compiled.check),
+            'kernels_built': self.kernels_built,
+            'kernels_reused': self.kernels_reused,
+        }
+
+    def generate_module(self):
+        compiled = self.compiled
+        return module_template.format(
+            hash = self.grammar_hash,
+            eol = eol,
+            symbols = format_tuple(compiled.symbols),
+            terminals = format_tuple(compiled.terminals),
+            base = format_tuple(compiled.base),
+            default = format_tuple(compiled.default),
+            check = format_tuple(compiled.check),
+            value = format_tuple(compiled.value),
+            prodlhs = format_tuple(self.prodlhs),
+            prodlen = format_tuple(self.prodlen),
+            lhscol = format_tuple([compiled.symindex.get(lhs, -1) for lhs in self.prodlhs]),
+            bypassed = format_tuple(sorted(self.bypassed)),
+        )
+
+    def write_module(self, filename):
+        #writes a self-contained module with the compiled table and a parse(tokens, actions) function
+        with open(filename, 'w') as f:
+            f.write(self.generate_module())
+
+    def read_table(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if not isinstance(data, dict) or not data.get('version') == tabversion:
+            return False
 
-        states = [CLR_State(pi, {LR1_Prod('S\'', [startsymbol], 0, {eol}, 0)})]
+        #a file with missing or malformed fields is rebuilt like a garbage one, so nothing is
+        #set on self until all fields have been read
+        try:
+            table = [dict([(sym, Action(SRG(a), n)) for sym, (a, n) in row.items()]) for row in data['table']]
+            conflicts = [Conflict(*c) for c in data['conflicts']]
+            compiled = CompiledTable(*data['compiled'])
+            fields = (data['prodlhs'], data['prodlen'], data['merge_conflicts'], data['counts'], data['kernels_built'], data['kernels_reused'])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return False
 
-        pi.stateid += 1
+        self.table = table
+        self.prodlhs, self.prodlen, self.merge_conflicts, self.report.counts, self.kernels_built, self.kernels_reused = fields
+        self.report.conflicts = conflicts
+        self.compiled = compiled
+        return True
 
-        counter = 0
+    def write_table(self, filename):
+        data = {
+            'version': tabversion,
+            'table': [dict([(sym, (a.action.value, a.number)) for sym, a in row.items()]) for row in self.table],
+            'prodlhs': self.prodlhs,
+            'prodlen': self.prodlen,
+            'merge_conflicts': self.merge_conflicts,
+            'conflicts': [(c.kind, c.state, c.symbol, c.rules, c.merged) for c in self.report.conflicts],
+            'counts': self.report.counts,
+            'kernels_built': self.kernels_built,
+            'kernels_reused': self.kernels_reused,
+            'compiled': (self.compiled.symbols, self.compiled.terminals, self.compiled.base, self.compiled.default, self.compiled.check, self.compiled.value),
+        }
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok = True)
+        #write to a temporary file first so concurrent workers never read a partial table
+        tmpname = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+
+    def parse(self, tokens, actions = None):
+        # tokens is an iterable of ply.lex LexTokens whose types are the grammar terminals.
+        # actions maps production Ids to callables taking the list of rhs values; productions
+        # without an action reduce to (lhs, values), those bypassed by optimize to their value.
+        compiled = self.compiled
+        base = compiled.base
+        default = compiled.default
+        check = compiled.check
+        value = compiled.value
+        symindex = compiled.symindex
+        termindex = compiled.termindex
+        prodlhs = self.prodlhs
+        prodlen = self.prodlen
+        lhscol = [symindex.get(lhs, -1) for lhs in prodlhs]
+        hooks = [None] * len(prodlen)
+        for Id in self.bypassed:
+            hooks[Id] = passthrough
+        if actions:
+            for Id, f in actions.items():
+                if Id in self.bypassed:
+                    raise ValueError("Production {} is bypassed, it cannot have an action".format(Id))
+                hooks[Id] = f
+
+        size = 64
+        statestack = [0] * size
+        valuestack = [None] * size
+        sp = 0
+
+        tokens = iter(tokens)
+        tok = next(tokens, None)
+        col = termindex.get(eol if tok is None else tok.type, -1)
 
         while True:
-            currId = states[counter].id
-            for sym in pi.terminals | pi.nonterminals - { epsilon }:
-                temp = states[counter].getNextProds(sym)
-                if temp:
-                    targetId = -1
-                    newstate = CLR_State(pi, temp)
-                    existing = [p for p in states if p == newstate]
-                    if not existing:
-                        pi.stateid += 1
-                        states.append(newstate)
-                        targetId = pi.stateid
-                    else:
-                        targetId = existing[0].id
-                    if currId >= len(pi.table):
-                        pi.table.append(dict())
-                    pi.table[currId][sym] = Action(SRG.SHIFT if sym in pi.terminals else SRG.GOTO, targetId)
-
-            temp = states[counter].reduceSet()
-            for rule in temp:
-                if currId >= len(pi.table):
-                    pi.table.append(dict())
-                for s in rule.la:
-                    if s in pi.table[currId]:
-                            if pi.table[currId][s].action == SRG.SHIFT:
-                                print("Shift-Reduce conflict in state {} for symbol {}".format(currId, s))
-                                continue
-                            else:
-                                print("Reduce-reduce conflict in state {} for rules {} and {} with symbol {}".format(currId, pi.table[currId][s].number, rule.Id, s))
-                    pi.table[currId][s] = Action(SRG.REDUCE, rule.Id)
-
-            counter += 1
-            if counter == len(states):
-                break
-
-        for s in states:
-            print(s, "\n")
+            state = statestack[sp]
+            i = base[state] + col
+            act = value[i] if col >= 0 and check[i] == col else default[state]
+
+            if act > 0:
+                sp += 1
+                if sp == size:
+                    statestack.extend([0] * size)
+                    valuestack.extend([None] * size)
+                    size *= 2
+                statestack[sp] = act - 1
+                valuestack[sp] = tok.value
+                tok = next(tokens, None)
+                col = termindex.get(eol if tok is None else tok.type, -1)
+                continue
 
-        print("\nTable:\n")
+            if act == 0:
+                if tok is None:
+                    raise ParseError("Unexpected end of input", None)
+                raise ParseError("Unexpected token {} at index {}".format(tok.type, tok.lexpos), tok)
 
-        for k in range(0, len(pi.table)):
-            print(k, pi.table[k])
-        #print(pi.table)
+            Id = -act - 1
+            if Id == 0:
+                return valuestack[sp]
 
+            n = prodlen[Id]
+            values = valuestack[sp - n + 1:sp + 1]
+            sp -= n
+            f = hooks[Id]
+            result = f(values) if f else (prodlhs[Id], values)
 
-        print("\n" * 5)
-
-        self.table = pi.table
+            sp += 1
+            if sp == size:
+                statestack.extend([0] * size)
+                valuestack.extend([None] * size)
+                size *= 2
+            statestack[sp] = value[base[statestack[sp - 1]] + lhscol[Id]] - 1
+            valuestack[sp] = result
 
 
 if __name__ == '__main__':
-
-    CLR_Parser("""T -> ( E ) | T * T
-        E -> E + E | T
-        T -> i""", 'E', {'i', '*', '(', ')', '+'})
-
-
-    CLR_Parser("""S -> A A
-    A -> a A | b""", 'S', {'a', 'b'})
-
-
-    CLR_Parser("""S -> S X | Y
-    X -> x | epsilon
-    Y -> y | epsilon""", 'S', {'x', 'y'})
-
-
-    CLR_Parser("""S -> a B D h
-        B -> c C
-        C -> b C | epsilon
-        D -> E F
-        E -> g | epsilon
-        F -> f | epsilon""", 'S', {'a', 'b', 'c', 'f', 'g', 'h'})
-
-    CLR_Parser("""S -> ( S ) | S , S | epsilon""", 'S', {'(', ')', ','})
-
-    CLR_Parser("""S -> S + S | a""", 'S', {'a', '+'})
+    import argparse
+
+    argparser = argparse.ArgumentParser(description = "Build an LR(1) parse table from a grammar file, or show the built-in examples")
+    argparser.add_argument('grammar', nargs = '?', help = "grammar file with lines of the form 'A -> x B | epsilon'")
+    argparser.add_argument('-s', '--start', help = "start symbol")
+    argparser.add_argument('-t', '--terminals', default = '', help = "whitespace separated terminals")
+    argparser.add_argument('-m', '--mode', default = 'clr', choices = ['clr', 'lalr', 'pager'])
+    argparser.add_argument('-c', '--cachedir', help = "directory for cached tables")
+    argparser.add_argument('-p', '--profile', action = 'store_true', help = "trace peak memory of every phase")
+    argparser.add_argument('-r', '--report', metavar = 'FILE', help = "write the full build report to FILE")
+    argparser.add_argument('-o', '--module', metavar = 'FILE', help = "write a standalone parser module to FILE")
+    argparser.add_argument('-j', '--workers', type = int, help = "build the canonical states in this many processes")
+    argparser.add_argument('-O', '--optimize', action = 'store_true', help = "bypass unit reductions, for grammars without actions on them")
+    argparser.add_argument('-P', '--precedence', default = '', help = "precedence levels, lowest first, as in 'left + -; left * /; right ^'")
+    args = argparser.parse_args()
+
+    if args.grammar and args.start is None:
+        argparser.error("a grammar file needs a start symbol, given with -s")
+
+    if args.grammar:
+        with open(args.grammar) as f:
+            grammar = f.read()
+        precedence = [tuple(level.split()) for level in args.precedence.split(';') if level.strip()]
+        parser = CLR_Parser(grammar, args.start, set(args.terminals.split()), mode = args.mode, cachedir = args.cachedir, profile = args.profile,
+            workers = args.workers, precedence = precedence)
+        if args.optimize:
+            parser.optimize()
+        for c in parser.report.conflicts:
+            print(c)
+        print(parser.report.summary(), end = '')
+        if args.report:
+            parser.report.write(args.report)
+        if args.module:
+            parser.write_module(args.module)
+    else:
+        CLR_Parser("""T -> ( E ) | T * T
+            E -> E + E | T
+            T -> i""", 'E', {'i', '*', '(', ')', '+'}, mode = args.mode, profile = args.profile, verbose = True)
+
+
+        CLR_Parser("""S -> A A
+        A -> a A | b""", 'S', {'a', 'b'}, mode = args.mode, profile = args.profile, verbose = True)
+
+
+        CLR_Parser("""S -> S X | Y
+        X -> x | epsilon
+        Y -> y | epsilon""", 'S', {'x', 'y'}, mode = args.mode, profile = args.profile, verbose = True)
+
+
+        CLR_Parser("""S -> a B D h
+            B -> c C
+            C -> b C | epsilon
+            D -> E F
+            E -> g | epsilon
+            F -> f | epsilon""", 'S', {'a', 'b', 'c', 'f', 'g', 'h'}, mode = args.mode, profile = args.profile, verbose = True)
+
+        CLR_Parser("""S -> ( S ) | S , S | epsilon""", 'S', {'(', ')', ','}, mode = args.mode, profile = args.profile, verbose = True)
+
+        CLR_Parser("""S -> S + S | a""", 'S', {'a', '+'}, mode = args.mode, profile = args.profile, verbose = True)
@@ -0,0 +1,222 @@
+#!/bin/env python3
+
+# Grammars used by the benchmarks. Every function returns (grammar, startsymbol, terminals)
+# in the form CLR_Parser takes them, the scalable ones take their size as argument. Some of
+# them also have a lexer module in lexers/, whose token types are the grammar terminals, and
+# a generator for inputs of a given size in bytes.
+
+import random
+
+from lexers import arithlex, jsonlex, sqllex
+
+def expr_grammar(levels):
+    #binary operators on levels precedence levels, the classic layered expression grammar
+    lines = []
+    terminals = {'(', ')', 'id'}
+    for k in range(levels):
+        op = 'op{}'.format(k)
+        terminals.add(op)
+        lines.append("E{} -> E{} {} E{} | E{}".format(k, k, op, k + 1, k + 1))
+    lines.append("E{} -> ( E0 ) | id".format(levels))
+    return "\n".join(lines), 'E0', terminals
+
+def list_grammar(kinds):
+    #a sequence of declarations of kinds different keywords, each with its own list
+    lines = ["S -> S Decl | Decl"]
+    terminals = {'id', ',', ';'}
+    for k in range(kinds):
+        kw = 'kw{}'.format(k)
+        terminals.add(kw)
+        lines.append("Decl -> {} L{} ;".format(kw, k))
+        lines.append("L{} -> L{} , id | id".format(k, k))
+    return "\n".join(lines), 'S', terminals
+
+def nested_grammar(depth):
+    #a chain of depth nonterminals nested in each other, with optional parts at every level
+    lines = []
+    terminals = {'x'}
+    for k in range(depth):
+        a = 'a{}'.format(k)
+        b = 'b{}'.format(k)
+        terminals |= {a, b}
+        lines.append("N{} -> {} N{} {} | N{} {} | N{}".format(k, a, k + 1, b, k + 1, b, k + 1))
+    lines.append("N{} -> x".format(depth))
+    return "\n".join(lines), 'N0', terminals
+
+def arith_grammar():
+    return """E -> E + T | T
+        T -> T * F | F
+        F -> ( E ) | i""", 'E', {'i', '+', '*', '(', ')'}
+
+def gen_arith_expr(rng, depth):
+    r = rng.random()
+    if depth <= 0 or r < 0.3:
+        return str(rng.randint(0, 999))
+    if r < 0.4:
+        return "(" + gen_arith_expr(rng, depth - 1) + ")"
+    return gen_arith_expr(rng, depth - 1) + rng.choice((" + ", " * ")) + gen_arith_expr(rng, depth - 1)
+
+def gen_arith(nbytes, seed = 0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < nbytes:
+        parts.append(gen_arith_expr(rng, 8))
+        length += len(parts[-1]) + 3
+    return " +\n".join(parts)
+
+json_terminals = {'{', '}', '[', ']', ',', ':', 'STRING', 'NUMBER', 'TRUE', 'FALSE', 'NULL'}
+
+def json_grammar():
+    return """Value -> Object | Array | STRING | NUMBER | TRUE | FALSE | NULL
+        Object -> { } | { Members }
+        Members -> Members , Pair | Pair
+        Pair -> STRING : Value
+        Array -> [ ] | [ Elements ]
+        Elements -> Elements , Value | Value""", 'Value', set(json_terminals)
+
+def gen_json_value(rng, depth):
+    r = rng.random()
+    if depth <= 0 or r < 0.5:
+        return rng.choice(['"{}"'.format(rng.choice(['name', 'value', 'id', 'a \\"quoted\\" text'])),
+            str(rng.randint(-1000, 1000)), '{:.3f}'.format(rng.random()), 'true', 'false', 'null'])
+    if r < 0.75:
+        return "[" + ", ".join([gen_json_value(rng, depth - 1) for i in range(rng.randint(0, 5))]) + "]"
+    return "{" + ", ".join(['"k{}": {}'.format(i, gen_json_value(rng, depth - 1)) for i in range(rng.randint(0, 5))]) + "}"
+
+def gen_json(nbytes, seed = 0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < nbytes:
+        parts.append(gen_json_value(rng, 4))
+        length += len(parts[-1]) + 2
+    return "[\n" + ",\n".join(parts) + "\n]"
+
+c_terminals = {';', ',', '=', '*', '(', ')', '[', ']', '{', '}', '?', ':', '<', '>', '+', '-', '/', '%',
+    '!', '&', '.', 'INT', 'CHAR', 'VOID', 'FLOAT', 'STRUCT', 'ID', 'IF', 'ELSE', 'WHILE', 'FOR',
+    'RETURN', 'BREAK', 'CONTINUE', 'ADDASSIGN', 'OR', 'AND', 'EQ', 'NE', 'LE', 'GE', 'INC', 'DEC',
+    'ARROW', 'NUMBER', 'STRING'}
+
+def c_grammar():
+    return """Unit -> Unit External | External
+        External -> Function | Declaration
+        Function -> Type Declarator Compound
+        Declaration -> Type InitList ;
+        InitList -> InitList , Init | Init
+        Init -> Declarator | Declarator = Assign
+        Type -> INT | CHAR | VOID | FLOAT | STRUCT ID
+        Declarator -> * Declarator | Direct
+        Direct -> ID | ( Declarator ) | Direct [ ] | Direct [ Expr ] | Direct ( ) | Direct ( Params )
+        Params -> Params , Param | Param
+        Param -> Type Declarator
+        Compound -> { } | { Items }
+        Items -> Items Item | Item
+        Item -> Declaration | Stmt
+        Stmt -> Compound | ExprStmt | IF ( Expr ) Stmt | IF ( Expr ) Stmt ELSE Stmt | WHILE ( Expr ) Stmt | FOR ( ExprStmt ExprStmt ) Stmt | FOR ( ExprStmt ExprStmt Expr ) Stmt | RETURN ; | RETURN Expr ; | BREAK ; | CONTINUE ;
+        ExprStmt -> ; | Expr ;
+        Expr -> Expr , Assign | Assign
+        Assign -> Cond | Unary = Assign | Unary ADDASSIGN Assign
+        Cond -> Or | Or ? Expr : Cond
+        Or -> Or OR And | And
+        And -> And AND Eq | Eq
+        Eq -> Eq EQ Rel | Eq NE Rel | Rel
+        Rel -> Rel < Add | Rel > Add | Rel LE Add | Rel GE Add | Add
+        Add -> Add + Mul | Add - Mul | Mul
+        Mul -> Mul * Unary | Mul / Unary | Mul % Unary | Unary
+        Unary -> Postfix | - Unary | ! Unary | * Unary | & Unary | INC Unary | DEC Unary
+        Postfix -> Primary | Postfix [ Expr ] | Postfix ( ) | Postfix ( Args ) | Postfix . ID | Postfix ARROW ID | Postfix INC | Postfix DEC
+        Args -> Args , Assign | Assign
+        Primary -> ID | NUMBER | STRING | ( Expr )""", 'Unit', set(c_terminals)
+
+sql_terminals = {';', ',', '*', '(', ')', '=', '<', '>', '+', '-', '/', '.', 'SELECT', 'FROM', 'WHERE',
+    'GROUP', 'BY', 'HAVING', 'ORDER', 'ASC', 'DESC', 'UNION', 'AS', 'JOIN', 'ON', 'AND', 'OR', 'NOT',
+    'LIKE', 'IS', 'NULL', 'IN', 'INSERT', 'INTO', 'VALUES', 'UPDATE', 'SET', 'DELETE', 'ID', 'NUMBER',
+    'STRING'}
+
+def sql_grammar():
+    return """Stmts -> Stmts Stmt | Stmt
+        Stmt -> Query ; | INSERT INTO ID VALUES ( Exprs ) ; | UPDATE ID SET Assigns Where ; | DELETE FROM ID Where ;
+        Assigns -> Assigns , ID = Expr | ID = Expr
+        Query -> Query UNION Select | Select
+        Select -> SELECT Columns FROM Tables Where Group Order
+        Columns -> * | ColumnList
+        ColumnList -> ColumnList , Column | Column
+        Column -> Expr | Expr AS ID
+        Tables -> Tables , Table | Table
+        Table -> ID | ID AS ID | Table JOIN ID ON Cond
+        Where -> WHERE Cond | epsilon
+        Group -> GROUP BY Exprs | GROUP BY Exprs HAVING Cond | epsilon
+        Order -> ORDER BY OrderList | epsilon
+        OrderList -> OrderList , OrderItem | OrderItem
+        OrderItem -> Expr | Expr ASC | Expr DESC
+        Cond -> Cond OR CondAnd | CondAnd
+        CondAnd -> CondAnd AND CondNot | CondNot
+        CondNot -> NOT CondNot | Pred
+        Pred -> Expr = Expr | Expr < Expr | Expr > Expr | Expr LIKE STRING | Expr IS NULL | Expr IN ( Exprs )
+        Exprs -> Exprs , Expr | Expr
+        Expr -> Expr + Term | Expr - Term | Term
+        Term -> Term * Factor | Term / Factor | Factor
+        Factor -> ID | ID . ID | NUMBER | STRING | ( Expr ) | ID ( Exprs ) | ID ( * )""", 'Stmts', set(sql_terminals)
+
+def gen_sql_expr(rng, depth):
+    r = rng.random()
+    if depth <= 0 or r < 0.5:
+        return rng.choice(['a', 'b.c', 'price', '42', "'text'", 'count(*)'])
+    if r < 0.6:
+        return "(" + gen_sql_expr(rng, depth - 1) + ")"
+    return gen_sql_expr(rng, depth - 1) + rng.choice([' + ', ' - ', ' * ', ' / ']) + gen_sql_expr(rng, depth - 1)
+
+def gen_sql_cond(rng):
+    conds = []
+    for i in range(rng.randint(1, 3)):
+        conds.append(gen_sql_expr(rng, 2) + rng.choice([' = ', ' < ', ' > ']) + gen_sql_expr(rng, 2))
+    return rng.choice([' AND ', ' OR ']).join(conds)
+
+def gen_sql_stmt(rng):
+    r = rng.random()
+    if r < 0.6:
+        stmt = "SELECT " + ", ".join([gen_sql_expr(rng, 2) for i in range(rng.randint(1, 4))])
+        stmt += " FROM t1 AS x JOIN t2 ON x.id = t2.id"
+        if rng.random() < 0.7:
+            stmt += " WHERE " + gen_sql_cond(rng)
+        if rng.random() < 0.3:
+            stmt += " GROUP BY a, b HAVING count(*) > 1"
+        if rng.random() < 0.3:
+            stmt += " ORDER BY a DESC, b"
+        return stmt + ";"
+    if r < 0.8:
+        return "INSERT INTO t VALUES (" + ", ".join([gen_sql_expr(rng, 1) for i in range(rng.randint(1, 5))]) + ");"
+    if r < 0.9:
+        return "UPDATE t SET a = " + gen_sql_expr(rng, 2) + " WHERE " + gen_sql_cond(rng) + ";"
+    return "DELETE FROM t WHERE " + gen_sql_cond(rng) + ";"
+
+def gen_sql(nbytes, seed = 0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < nbytes:
+        parts.append(gen_sql_stmt(rng))
+        length += len(parts[-1]) + 1
+    return "\n".join(parts)
+
+#name -> (grammar function, default sizes), fixed grammars have the single size None
+suites = {
+    'expr': (expr_grammar, [4, 8, 16, 32]),
+    'lists': (list_grammar, [4, 16, 64]),
+    'nested': (nested_grammar, [4, 16, 64]),
+    'json': (json_grammar, [None]),
+    'c': (c_grammar, [None]),
+    'sql': (sql_grammar, [None]),
+}
+
+def make_grammar(name, size = None):
+    func, sizes = suites[name]
+    return func() if size is None else func(size)
+
+#name -> (grammar function, lexer module, input generator) for the throughput benchmarks
+workloads = {
+    'arith': (arith_grammar, arithlex, gen_arith),
+    'json': (json_grammar, jsonlex, gen_json),
+    'sql': (sql_grammar, sqllex, gen_sql),
+}
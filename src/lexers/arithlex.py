@@ -0,0 +1,12 @@
+# Lexer for grammars.arith_grammar
+
+import ply.lex as lex
+
+tokens = ( 'i', )
+literals = '+*()'
+
+t_ignore = ' \t\n'
+t_i = r'\d+'
+
+def t_error(t):
+    raise lex.LexError("Illegal character {}".format(t.value[0]), t.value)
@@ -0,0 +1,16 @@
+# Lexer for grammars.json_grammar
+
+import ply.lex as lex
+
+tokens = ( 'STRING', 'NUMBER', 'TRUE', 'FALSE', 'NULL' )
+literals = '{}[],:'
+
+t_ignore = ' \t\n'
+t_STRING = r'"(?:[^"\\]|\\.)*"'
+t_NUMBER = r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'
+t_TRUE = r'true'
+t_FALSE = r'false'
+t_NULL = r'null'
+
+def t_error(t):
+    raise lex.LexError("Illegal character {}".format(t.value[0]), t.value)
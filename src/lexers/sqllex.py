@@ -0,0 +1,24 @@
+# Lexer for grammars.sql_grammar
+
+import ply.lex as lex
+
+reserved = ( 'SELECT', 'FROM', 'WHERE', 'GROUP', 'BY', 'HAVING', 'ORDER', 'ASC', 'DESC', 'UNION', 'AS',
+    'JOIN', 'ON', 'AND', 'OR', 'NOT', 'LIKE', 'IS', 'NULL', 'IN', 'INSERT', 'INTO', 'VALUES', 'UPDATE',
+    'SET', 'DELETE' )
+
+tokens = reserved + ( 'ID', 'NUMBER', 'STRING' )
+literals = ';,*()=<>+-/.'
+
+t_ignore = ' \t\n'
+t_NUMBER = r'\d+'
+t_STRING = r"'[^']*'"
+
+keywords = dict([(k, k) for k in reserved])
+
+def t_ID(t):
+    r'[A-Za-z_][A-Za-z_0-9]*'
+    t.type = keywords.get(t.value.upper(), 'ID')
+    return t
+
+def t_error(t):
+    raise lex.LexError("Illegal character {}".format(t.value[0]), t.value)
@@ -35,10 +35,17 @@
 
 import re
 import sys
+import codecs
 import types
 import copy
 import os
 import inspect
+from array import array
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 # This tuple contains acceptable string types
 StringTypes = (str, bytes)
@@ -53,11 +60,88 @@ class LexError(Exception):
         self.args = (message,)
         self.text = s
 
-# Token class.  This class is used to represent the tokens produced.
+# Value of tokens whose value is taken from the input
+_lazy = object()
+
+# Characters of the rest of bytes input in the value of error tokens
+_errorchars = 80
+
+# Token class.  This class is used to represent the tokens produced.  Unless
+# a value is assigned, the value is sliced from the input (_data) at lexpos
+# whenever it is read, so tokens kept around hold no copy of their text.  The
+# length is kept rather than the end offset, as small ints are not allocated.
+# For bytes input, _data is a _DecodedInput and the slice is decoded.
 class LexToken(object):
+    __slots__ = ('type', '_value', 'lineno', 'lexpos', '_len', '_data', 'lexer')
+
+    @property
+    def value(self):
+        value = self._value
+        if value is _lazy:
+            return self._data[self.lexpos:self.lexpos + self._len]
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
     def __repr__(self):
         return f'LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})'
 
+# Batch of tokens produced by Lexer.tokenize_batch().  Tokens are stored as
+# parallel arrays of type ids, start and end offsets and line numbers. Values
+# are only sliced from the input when asked for, except for values that a
+# token rule changed, which are kept in the values dictionary by token index.
+class TokenBatch(object):
+    def __init__(self, lexdata, typenames, types, starts, ends, linenos, values):
+        self.lexdata = lexdata        # Input the offsets refer to
+        self.typenames = typenames    # List mapping type ids to token types
+        self.types = types            # Type id of each token
+        self.starts = starts          # Start offset of each token, in the input it is from
+        self.ends = ends              # End offset of each token
+        self.linenos = linenos        # Line number of each token
+        self.values = values          # Values that differ from the matched text
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, i):
+        return self.typenames[self.types[i]]
+
+    def value(self, i):
+        if i in self.values:
+            return self.values[i]
+        return self.lexdata[self.starts[i]:self.ends[i]]
+
+    def token(self, i):
+        tok = LexToken()
+        tok.type = self.typenames[self.types[i]]
+        tok.lineno = self.linenos[i]
+        tok.lexpos = self.starts[i]
+        tok._len = self.ends[i] - self.starts[i]
+        tok._value = _lazy
+        tok._data = self.lexdata
+        if i in self.values:
+            tok.value = self.values[i]
+        return tok
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self.token(i)
+
+# View of bytes-like input (bytes, memoryview, mmap) whose slices are decoded,
+# the input token values of bytes input are sliced from.  Rules may match part
+# of a character, which decodes to U+FFFD instead of raising.
+class _DecodedInput(object):
+    __slots__ = ('data', 'encoding')
+
+    def __init__(self, data, encoding):
+        self.data = data
+        self.encoding = encoding
+
+    def __getitem__(self, key):
+        return str(self.data[key], self.encoding, 'replace')
+
 # This object is a stand-in for a logging object created by the
 # logging module.
 
@@ -83,8 +167,11 @@ class PlyLogger(object):
 # The following Lexer class implements the lexer runtime.   There are only
 # a few public methods and attributes:
 #
-#    input()          -  Store a new string in the lexer
+#    input()          -  Store a new string or bytes-like input in the lexer
+#    input_stream()   -  Lex a file object or an iterable of strings
 #    token()          -  Get the next token
+#    tokenize_batch() -  Get the next tokens as a TokenBatch
+#    tokenize_all()   -  Get all tokens of a string as a TokenBatch
 #    clone()          -  Clone the lexer
 #
 #    lineno           -  Current line number
@@ -101,6 +188,10 @@ class Lexer:
         self.lexstatere = {}          # Dictionary mapping lexer states to master regexs
         self.lexstateretext = {}      # Dictionary mapping lexer states to regex strings
         self.lexstaterenames = {}     # Dictionary mapping lexer states to symbol names
+        self.lexfirst = {}            # First character index of the current state, mapping
+                                      # ASCII characters to the master regexs of the rules
+                                      # that can start with them
+        self.lexstatefirst = {}       # Dictionary mapping lexer states to first character indexes
         self.lexstate = 'INITIAL'     # Current lexer state
         self.lexstatestack = []       # Stack of lexer states
         self.lexstateinfo = None      # State information
@@ -108,7 +199,11 @@ class Lexer:
         self.lexstateerrorf = {}      # Dictionary of error functions for each state
         self.lexstateeoff = {}        # Dictionary of eof functions for each state
         self.lexreflags = 0           # Optional re compile flags
-        self.lexdata = None           # Actual input data (as a string)
+        self.lexdata = None           # Actual input data (as a string or bytes-like object)
+        self.lexvalues = None         # Input token values are sliced from, lexdata or a _DecodedInput
+        self.lexencoding = None       # Encoding of bytes-like input, None for strings
+        self.lexbytesre = {}          # Dictionary mapping lexer states to master regexs for bytes input
+        self.lexbyteliterals = {}     # Dictionary mapping bytes to the one byte literals
         self.lexpos = 0               # Current position in input text
         self.lexlen = 0               # Length of the input text
         self.lexerrorf = None         # Error rule (if any)
@@ -118,6 +213,12 @@ class Lexer:
         self.lexliterals = ''         # Literal characters that can be passed through
         self.lexmodule = None         # Module
         self.lineno = 1               # Current line number
+        self.lextypenames = []        # Token types by the type ids used in TokenBatch
+        self.lextypeids = {}          # Dictionary mapping token types to type ids
+        self.lexbatchre = {}          # Dictionary mapping lexer states to tokenize_batch regexs
+        self.lexstream = None         # Iterator of the chunks not read yet by input_stream()
+        self.lexoffset = 0            # Offset of lexdata in the stream
+        self.lexlookahead = 0         # Input kept after lexpos by input_stream(), the longest token
 
     def clone(self, object=None):
         c = copy.copy(self)
@@ -127,32 +228,138 @@ class Lexer:
         # the lexstatere and lexstateerrorf tables.
 
         if object:
-            newtab = {}
-            for key, ritem in self.lexstatere.items():
+            rebound = {}
+            def rebind(ritem):
                 newre = []
                 for cre, findex in ritem:
-                    newfindex = []
-                    for f in findex:
-                        if not f or not f[0]:
-                            newfindex.append(f)
-                            continue
-                        newfindex.append((getattr(object, f[0].__name__), f[1]))
-                newre.append((cre, newfindex))
-                newtab[key] = newre
-            c.lexstatere = newtab
+                    if id(findex) not in rebound:
+                        newfindex = []
+                        for f in findex:
+                            if not f or not f[0]:
+                                newfindex.append(f)
+                                continue
+                            newfindex.append((getattr(object, f[0].__name__), f[1]))
+                        rebound[id(findex)] = newfindex
+                    newre.append((cre, rebound[id(findex)]))
+                return newre
+
+            c.lexstatere = {}
+            for key, ritem in self.lexstatere.items():
+                c.lexstatere[key] = rebind(ritem)
+            c.lexstatefirst = {}
+            for key, first in self.lexstatefirst.items():
+                c.lexstatefirst[key] = {ch: rebind(ritem) for ch, ritem in first.items()}
             c.lexstateerrorf = {}
             for key, ef in self.lexstateerrorf.items():
                 c.lexstateerrorf[key] = getattr(object, ef.__name__)
             c.lexmodule = object
+            c.lexbatchre = {}
+            c.lexbytesre = {}
+            c.begin(c.lexstate)
+        if 'token' in self.__dict__:
+            c.token = c._stream_token
         return c
 
     # ------------------------------------------------------------
-    # input() - Push a new string into the lexer
+    # input() - Push a new string into the lexer.  Bytes, memoryviews
+    # and mmaps are lexed in place with byte regexs compiled from the
+    # same rules.  lexpos is then a byte offset, and token values are
+    # decoded with the encoding when they are read.  Rules that slice the
+    # input themselves can slice lexvalues to get strings either way.
+    #
+    # The encoding must be ASCII compatible, as the byte regexs match
+    # the encoded rules byte by byte.  For non-ASCII text they may match
+    # differently than on strings: \w, \d, \s, \b and IGNORECASE only
+    # know ASCII, and ., negated classes and classes with non-ASCII
+    # characters match single bytes.  Rules compiled with re.ASCII that
+    # only use non-ASCII characters in literal text match the same.
     # ------------------------------------------------------------
-    def input(self, s):
+    def input(self, s, encoding='utf-8'):
+        if isinstance(s, str):
+            encoding = None
+            self.lexvalues = s
+        else:
+            if encoding != self.lexencoding and not _ascii_compatible(encoding):
+                raise ValueError(f'Encoding {encoding!r} of bytes input is not ASCII compatible')
+            if isinstance(s, memoryview):
+                s = s.cast('B')
+            self.lexvalues = _DecodedInput(s, encoding)
         self.lexdata = s
         self.lexpos = 0
         self.lexlen = len(s)
+        self.lexstream = None
+        self.lexoffset = 0
+        self.__dict__.pop('token', None)
+        if encoding != self.lexencoding:
+            self.lexencoding = encoding
+            self.lexbytesre = {}
+            self.lexbyteliterals = {}
+            if encoding is not None:
+                for c in self.lexliterals:
+                    b = c.encode(encoding)
+                    if len(b) == 1:
+                        self.lexbyteliterals[b[0]] = c
+            if self.lexstatere:
+                self.begin(self.lexstate)
+
+    # ------------------------------------------------------------
+    # input_stream() - Lex a file object or an iterable of strings in
+    # chunks.  lexdata only holds the input from the current token on,
+    # at least lookahead characters of it and at most about twice that,
+    # lexpos and lexdata are relative to lexoffset.  Tokens have absolute
+    # lexpos and values copied out of lexdata.
+    #
+    # The rules only see the lookahead, which must be longer than any
+    # token.  A token reaching past it raises LexError, but a rule that
+    # would only match a longer token with the rest of the input can not
+    # be told from one that does not match.  Rules must not slice lexdata
+    # from a position saved in an earlier token either, that part of the
+    # input may have been dropped already.
+    # ------------------------------------------------------------
+    def input_stream(self, stream, chunksize=65536, lookahead=65536):
+        self.input('')
+        if hasattr(stream, 'read'):
+            stream = _read_chunks(stream, chunksize)
+        self.lexstream = iter(stream)
+        self.lexlookahead = lookahead
+        self.token = self._stream_token
+
+    # ------------------------------------------------------------
+    # _refill() - Drop the input before lexpos and read chunks of the
+    # stream until twice the lookahead is left, so the buffer is copied
+    # once per lookahead at most.  Returns False if there was nothing
+    # left to read, the stream is closed at its end
+    # ------------------------------------------------------------
+    def _refill(self, lexpos):
+        rest = self.lexdata[lexpos:]
+        chunks = [rest]
+        size = len(rest)
+        for chunk in self.lexstream:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= 2 * self.lexlookahead and size > len(rest):
+                break
+        else:
+            self.lexstream = None
+        if size == len(rest):
+            return False
+        self.lexoffset += lexpos
+        self.lexdata = self.lexvalues = ''.join(chunks)
+        self.lexpos = 0
+        self.lexlen = size
+        return True
+
+    # ------------------------------------------------------------
+    # _stream_token() - token() for input_stream()
+    # ------------------------------------------------------------
+    def _stream_token(self):
+        tok = Lexer.token(self)
+        if tok is not None:
+            if tok._value is _lazy:
+                tok._value = tok._data[tok.lexpos:tok.lexpos + tok._len]
+            tok._data = None
+            tok.lexpos += self.lexoffset
+        return tok
 
     # ------------------------------------------------------------
     # begin() - Changes the lexing state
@@ -160,13 +367,43 @@ class Lexer:
     def begin(self, state):
         if state not in self.lexstatere:
             raise ValueError(f'Undefined state {state!r}')
-        self.lexre = self.lexstatere[state]
+        if self.lexencoding is None:
+            self.lexre = self.lexstatere[state]
+            self.lexfirst = self.lexstatefirst.get(state, {})
+            self.lexignore = self.lexstateignore.get(state, '')
+        else:
+            self.lexre, self.lexfirst = self.lexbytesre.get(state) or self._bytesre(state)
+            self.lexignore = self.lexstateignore.get(state, '').encode(self.lexencoding)
         self.lexretext = self.lexstateretext[state]
-        self.lexignore = self.lexstateignore.get(state, '')
         self.lexerrorf = self.lexstateerrorf.get(state, None)
         self.lexeoff = self.lexstateeoff.get(state, None)
         self.lexstate = state
 
+    # ------------------------------------------------------------
+    # _bytesre() - Compile the master regexs of a state and of its first
+    # character index for bytes input, where the index maps byte values.
+    # Rules keep their group numbers, so the group index lists are shared
+    # ------------------------------------------------------------
+    def _bytesre(self, state):
+        encoded = {}
+        def encode(ritem):
+            if id(ritem) not in encoded:
+                encoded[id(ritem)] = newre = []
+                for cre, findex in ritem:
+                    if cre not in encoded:
+                        encoded[cre] = re.compile(cre.pattern.encode(self.lexencoding), cre.flags & ~re.UNICODE)
+                    newre.append((encoded[cre], findex))
+            return encoded[id(ritem)]
+
+        # Byte regexs treat \x1c-\x1f as \S, unlike the str ones the index is built for,
+        # so these bytes are left to the full regexs
+        first = {}
+        for ch, ritem in self.lexstatefirst.get(state, {}).items():
+            if not '\x1c' <= ch <= '\x1f':
+                first[ord(ch)] = encode(ritem)
+        self.lexbytesre[state] = (encode(self.lexstatere[state]), first)
+        return self.lexbytesre[state]
+
     # ------------------------------------------------------------
     # push_state() - Changes the lexing state and saves old on stack
     # ------------------------------------------------------------
@@ -187,10 +424,35 @@ class Lexer:
         return self.lexstate
 
     # ------------------------------------------------------------
-    # skip() - Skip ahead n characters
+    # skip() - Skip ahead n characters, the bytes of n whole characters
+    # for bytes input
     # ------------------------------------------------------------
     def skip(self, n):
-        self.lexpos += n
+        if self.lexencoding is None:
+            self.lexpos += n
+        else:
+            self.lexpos += self._charlen(self.lexpos, n)
+
+    # ------------------------------------------------------------
+    # _charlen() - Number of bytes of the n characters at pos of bytes
+    # input, fewer at its end
+    # ------------------------------------------------------------
+    def _charlen(self, pos, n):
+        decoder = codecs.getincrementaldecoder(self.lexencoding)('replace')
+        end = pos
+        while n > 0 and end < self.lexlen:
+            n -= len(decoder.decode(self.lexdata[end:end + 1]))
+            end += 1
+        return end - pos
+
+    # ------------------------------------------------------------
+    # _rest() - The rest of the input from lexpos, for errors.  Only
+    # its first characters for bytes input, which may be a whole file
+    # ------------------------------------------------------------
+    def _rest(self, lexpos):
+        if self.lexencoding is None:
+            return self.lexdata[lexpos:]
+        return self.lexvalues[lexpos:lexpos + self._charlen(lexpos, _errorchars)]
 
     # ------------------------------------------------------------
     # token() - Return the next token from the Lexer
@@ -205,38 +467,66 @@ class Lexer:
         lexlen    = self.lexlen
         lexignore = self.lexignore
         lexdata   = self.lexdata
+        lexvalues = self.lexvalues
+        lexfirst  = self.lexfirst
+        lexlimit  = lexlen if self.lexstream is None else lexlen - self.lexlookahead
+
+        while True:
+            if lexpos >= lexlimit:
+                # Read more of input_stream() when less than the lookahead is left
+                if self.lexstream is not None and self._refill(lexpos):
+                    lexpos, lexlen, lexdata, lexvalues = 0, self.lexlen, self.lexdata, self.lexvalues
+                    lexlimit = lexlen if self.lexstream is None else lexlen - self.lexlookahead
+                    continue
+                lexlimit = lexlen
+                if lexpos >= lexlen:
+                    break
 
-        while lexpos < lexlen:
             # This code provides some short-circuit code for whitespace, tabs, and other ignored characters
             if lexdata[lexpos] in lexignore:
                 lexpos += 1
                 continue
 
-            # Look for a regular expression match
-            for lexre, lexindexfunc in self.lexre:
+            # Look for a regular expression match, among the rules that can start with the character
+            for lexre, lexindexfunc in lexfirst.get(lexdata[lexpos], self.lexre):
                 m = lexre.match(lexdata, lexpos)
                 if not m:
                     continue
 
-                # Create a token for return
-                tok = LexToken()
-                tok.value = m.group()
-                tok.lineno = self.lineno
-                tok.lexpos = lexpos
+                # A match reaching the end of input_stream() input may go on past it
+                end = m.end()
+                if end == lexlen and self.lexstream is not None:
+                    self.lexpos = lexpos
+                    raise LexError(f"Token at index {self.lexoffset + lexpos} is longer than the lookahead "
+                                   f"of {self.lexlookahead} characters", lexdata[lexpos:])
 
-                i = m.lastindex
-                func, tok.type = lexindexfunc[i]
+                # Create a token for return, its value is only sliced when read
+                func, type = lexindexfunc[m.lastindex]
 
                 if not func:
                     # If no token type was set, it's an ignored token
-                    if tok.type:
-                        self.lexpos = m.end()
+                    if type:
+                        tok = LexToken()
+                        tok.type = type
+                        tok.lineno = self.lineno
+                        tok.lexpos = lexpos
+                        tok._len = end - lexpos
+                        tok._value = _lazy
+                        tok._data = lexvalues
+                        self.lexpos = end
                         return tok
                     else:
-                        lexpos = m.end()
+                        lexpos = end
                         break
 
-                lexpos = m.end()
+                tok = LexToken()
+                tok.type = type
+                tok.lineno = self.lineno
+                tok.lexpos = lexpos
+                tok._len = end - lexpos
+                tok._value = _lazy
+                tok._data = lexvalues
+                lexpos = end
 
                 # If token is processed by a function, call it
 
@@ -244,30 +534,38 @@ class Lexer:
                 self.lexmatch = m
                 self.lexpos = lexpos
                 newtok = func(tok)
-                del tok.lexer
                 del self.lexmatch
 
                 # Every function must return a token, if nothing, we just move to next token
                 if not newtok:
                     lexpos    = self.lexpos         # This is here in case user has updated lexpos.
                     lexignore = self.lexignore      # This is here in case there was a state change
+                    lexfirst  = self.lexfirst
                     break
                 return newtok
             else:
-                # No match, see if in literals
-                if lexdata[lexpos] in self.lexliterals:
+                # No match, see if in literals.  Bytes input looks up the byte
+                c = lexdata[lexpos]
+                if self.lexencoding is not None:
+                    c = self.lexbyteliterals.get(c)
+                if c is not None and c in self.lexliterals:
                     tok = LexToken()
-                    tok.value = lexdata[lexpos]
+                    tok.type = c
                     tok.lineno = self.lineno
-                    tok.type = tok.value
                     tok.lexpos = lexpos
+                    tok._len = 1
+                    tok._value = _lazy
+                    tok._data = lexvalues
                     self.lexpos = lexpos + 1
                     return tok
 
-                # No match. Call t_error() if defined.
+                # No match. Call t_error() if defined.  The value is the rest of the input,
+                # or its first characters for bytes input
                 if self.lexerrorf:
                     tok = LexToken()
-                    tok.value = self.lexdata[lexpos:]
+                    tok._len = lexlen - lexpos if self.lexencoding is None else self._charlen(lexpos, _errorchars)
+                    tok._value = _lazy
+                    tok._data = lexvalues
                     tok.lineno = self.lineno
                     tok.type = 'error'
                     tok.lexer = self
@@ -276,16 +574,16 @@ class Lexer:
                     newtok = self.lexerrorf(tok)
                     if lexpos == self.lexpos:
                         # Error method didn't change text position at all. This is an error.
-                        raise LexError(f"Scanning error. Illegal character {lexdata[lexpos]!r}",
-                                       lexdata[lexpos:])
+                        rest = self._rest(lexpos)
+                        raise LexError(f"Scanning error. Illegal character {rest[0]!r}", rest)
                     lexpos = self.lexpos
                     if not newtok:
                         continue
                     return newtok
 
                 self.lexpos = lexpos
-                raise LexError(f"Illegal character {lexdata[lexpos]!r} at index {lexpos}",
-                               lexdata[lexpos:])
+                rest = self._rest(lexpos)
+                raise LexError(f"Illegal character {rest[0]!r} at index {lexpos}", rest)
 
         if self.lexeoff:
             tok = LexToken()
@@ -303,6 +601,280 @@ class Lexer:
             raise RuntimeError('No input string given with input()')
         return None
 
+    # ------------------------------------------------------------
+    # tokenize_batch() - Return the next n tokens (all if n is None) as a
+    # TokenBatch, which is empty at the end of the input.  Runs of tokens
+    # of string rules, ignored characters and literals are scanned with
+    # finditer() over a version of the master regex that also consumes
+    # the ignored characters, without creating LexTokens.  Token rule
+    # functions, t_error() and t_eof() are called as token() calls them.
+    # When they give new input with input(), the scan goes on in it, and
+    # the values of its tokens are kept, as the offsets of the batch only
+    # refer to the input it started in.
+    # ------------------------------------------------------------
+    def tokenize_batch(self, n=None):
+        if self.lexdata is None:
+            raise RuntimeError('No input string given with input()')
+        if 'token' in self.__dict__:
+            raise RuntimeError('tokenize_batch() does not support input_stream()')
+        if self.lexencoding is not None:
+            raise RuntimeError('tokenize_batch() does not support bytes input')
+
+        types = array('i')
+        starts = array('q')
+        ends = array('q')
+        linenos = array('q')
+        values = {}
+        typeids = self.lextypeids
+
+        lexpos    = self.lexpos
+        lexlen    = self.lexlen
+        lexignore = self.lexignore
+        lexdata   = self.lexdata
+        lineno    = self.lineno
+        data      = lexdata
+        count     = 0
+
+        types_append   = types.append
+        starts_append  = starts.append
+        ends_append    = ends.append
+        linenos_append = linenos.append
+
+        while count != n:
+            if lexdata is not self.lexdata:
+                # A rule gave new input
+                if 'token' in self.__dict__ or self.lexencoding is not None:
+                    raise RuntimeError('tokenize_batch() only supports new input given as a string')
+                lexdata = self.lexdata
+                lexlen  = self.lexlen
+
+            if lexpos >= lexlen:
+                # At the end of the input, let token() call t_eof(), which may give new input
+                if not self.lexeoff:
+                    break
+                self.lexpos = lexpos
+                self.lineno = lineno
+                tok = self.token()
+                lexpos    = self.lexpos
+                lexignore = self.lexignore
+                lineno    = self.lineno
+                if not tok:
+                    break
+                types_append(self._typeid(tok.type))
+                starts_append(tok.lexpos)
+                ends_append(lexpos)
+                linenos_append(tok.lineno)
+                values[count] = tok.value
+                count += 1
+                continue
+
+            state = self.lexstate
+            batchre = self.lexbatchre.get(state)
+            if batchre is None:
+                batchre = self._batchre()
+            finditer, groupids, lexre, lexindexfunc = batchre
+
+            # Fast path. It stops at gaps, which are left to the code below, and after
+            # token rule functions that moved lexpos, changed the state or the input.
+            # Tokens of new input need their values, so they take the code below
+            if finditer and lexdata is data:
+                for m in finditer(lexdata, lexpos):
+                    if m.start() != lexpos:
+                        break
+                    i = m.lastindex
+                    typeid = groupids[i]
+                    if typeid == -4:
+                        break
+                    end = m.end()
+
+                    if typeid == -2:
+                        start = m.start(i)
+                        func, type = lexindexfunc[i]
+                        tok = LexToken()
+                        tok.type = type
+                        tok.lineno = lineno
+                        tok.lexpos = start
+                        tok._len = end - start
+                        tok._value = _lazy
+                        tok._data = lexdata
+                        tok.lexer = self
+                        self.lexmatch = lexre.match(lexdata, start)
+                        self.lexpos = end
+                        self.lineno = lineno
+                        newtok = func(tok)
+                        del self.lexmatch
+
+                        lineno = self.lineno
+                        if newtok:
+                            typeid = typeids.get(newtok.type)
+                            types_append(self._typeid(newtok.type) if typeid is None else typeid)
+                            starts_append(newtok.lexpos)
+                            ends_append(end)
+                            linenos_append(newtok.lineno)
+                            if newtok._value is not _lazy and not newtok.value == lexdata[newtok.lexpos:end]:
+                                values[count] = newtok.value
+                            count += 1
+                        if self.lexpos != end or self.lexstate != state or self.lexdata is not lexdata:
+                            lexpos    = self.lexpos
+                            lexignore = self.lexignore
+                            break
+                    elif typeid != -1:
+                        if typeid == -3:
+                            typeid = typeids[lexdata[end - 1]]
+                        types_append(typeid)
+                        starts_append(m.start(i))
+                        ends_append(end)
+                        linenos_append(lineno)
+                        count += 1
+                    lexpos = end
+                    if count == n:
+                        break
+                if lexpos >= lexlen or count == n or self.lexdata is not lexdata:
+                    continue
+
+            if lexdata[lexpos] in lexignore:
+                lexpos += 1
+                continue
+
+            for lexre, lexindexfunc in self.lexfirst.get(lexdata[lexpos], self.lexre):
+                m = lexre.match(lexdata, lexpos)
+                if not m:
+                    continue
+
+                func, type = lexindexfunc[m.lastindex]
+                end = m.end()
+
+                if not func:
+                    if type:
+                        types.append(self._typeid(type))
+                        starts.append(lexpos)
+                        ends.append(end)
+                        linenos.append(lineno)
+                        if lexdata is not data:
+                            values[count] = lexdata[lexpos:end]
+                        count += 1
+                    lexpos = end
+                    break
+
+                tok = LexToken()
+                tok.type = type
+                tok.lineno = lineno
+                tok.lexpos = lexpos
+                tok._len = end - lexpos
+                tok._value = _lazy
+                tok._data = lexdata
+                tok.lexer = self
+                self.lexmatch = m
+                self.lexpos = end
+                self.lineno = lineno
+                newtok = func(tok)
+                del self.lexmatch
+
+                lexpos    = self.lexpos
+                lexignore = self.lexignore
+                lineno    = self.lineno
+                if newtok:
+                    types.append(self._typeid(newtok.type))
+                    starts.append(newtok.lexpos)
+                    ends.append(end)
+                    linenos.append(newtok.lineno)
+                    if lexdata is not data or newtok._value is not _lazy and not newtok.value == lexdata[newtok.lexpos:end]:
+                        values[count] = newtok.value
+                    count += 1
+                break
+            else:
+                if lexdata[lexpos] in self.lexliterals:
+                    types.append(self._typeid(lexdata[lexpos]))
+                    starts.append(lexpos)
+                    ends.append(lexpos + 1)
+                    linenos.append(lineno)
+                    if lexdata is not data:
+                        values[count] = lexdata[lexpos]
+                    lexpos += 1
+                    count += 1
+                    continue
+
+                # No match, token() calls t_error() or raises LexError
+                self.lexpos = lexpos
+                self.lineno = lineno
+                tok = self.token()
+                lexpos    = self.lexpos
+                lexignore = self.lexignore
+                lineno    = self.lineno
+                if tok:
+                    types.append(self._typeid(tok.type))
+                    starts.append(tok.lexpos)
+                    ends.append(lexpos if self.lexdata is lexdata else tok.lexpos)
+                    linenos.append(tok.lineno)
+                    if lexdata is not data or self.lexdata is not lexdata or not tok.value == lexdata[tok.lexpos:lexpos]:
+                        values[count] = tok.value
+                    count += 1
+
+        self.lexpos = lexpos
+        self.lineno = lineno
+        return TokenBatch(data, self.lextypenames, types, starts, ends, linenos, values)
+
+    # ------------------------------------------------------------
+    # _batchre() - Build the regex used by tokenize_batch() for the
+    # current state: the master regex preceded by a possessive run of
+    # ignored characters and followed by a group for the literals.
+    # Returns its finditer method, or None if the master regex had to be
+    # split, a list mapping group numbers to type ids, where -1 is an
+    # ignored token, -2 a function rule, -3 a literal and -4 a group that
+    # is not a rule, and the master regex with its group index list.
+    # ------------------------------------------------------------
+    def _batchre(self):
+        finditer = None
+        groupids = []
+        lexre = lexindexfunc = None
+        if len(self.lexre) == 1:
+            lexre, lexindexfunc = self.lexre[0]
+            ignore = ''.join([re.escape(c) for c in self.lexignore])
+            literals = ''.join([re.escape(c) for c in self.lexliterals])
+            regex = '(?:[%s]*+)' % ignore if ignore else ''
+            if literals:
+                regex += '(?:%s|(?P<_literal_>[%s]))' % (lexre.pattern, literals)
+            else:
+                regex += '(?:%s)' % lexre.pattern
+            try:
+                batchre = re.compile(regex, lexre.flags)
+            except re.error:
+                batchre = None
+            if batchre is not None and batchre.groups == lexre.groups + bool(literals):
+                finditer = batchre.finditer
+                for i in range(batchre.groups + 1):
+                    entry = lexindexfunc[i] if i < len(lexindexfunc) else None
+                    if i > lexre.groups:
+                        groupids.append(-3)
+                    elif entry is None:
+                        groupids.append(-4)
+                    elif entry[0]:
+                        groupids.append(-2)
+                    elif entry[1] is None:
+                        groupids.append(-1)
+                    else:
+                        groupids.append(self._typeid(entry[1]))
+        self.lexbatchre[self.lexstate] = (finditer, groupids, lexre, lexindexfunc)
+        return self.lexbatchre[self.lexstate]
+
+    # ------------------------------------------------------------
+    # tokenize_all() - Tokenize a whole string into a TokenBatch
+    # ------------------------------------------------------------
+    def tokenize_all(self, data):
+        self.input(data)
+        return self.tokenize_batch()
+
+    # ------------------------------------------------------------
+    # _typeid() - Return the type id of a token type, assigning a new
+    # one to types that were not seen before
+    # ------------------------------------------------------------
+    def _typeid(self, type):
+        typeid = self.lextypeids.get(type)
+        if typeid is None:
+            typeid = self.lextypeids[type] = len(self.lextypenames)
+            self.lextypenames.append(type)
+        return typeid
+
     # Iterator interface
     def __iter__(self):
         return self
@@ -377,6 +949,138 @@ def _form_master_re(relist, reflags, ldict, toknames):
         rlist, rre, rnames = _form_master_re(relist[m:], reflags, ldict, toknames)
         return (llist+rlist), (lre+rre), (lnames+rnames)
 
+# -----------------------------------------------------------------------------
+# _first_chars()
+#
+# Returns the set of ASCII characters a rule regex can start with, or None if
+# it is not known, for instance when the regex can match the empty string.
+# The set may be larger than the exact one, never smaller.  Other characters
+# are not indexed, as Lexer.token() tries every rule on them.
+# -----------------------------------------------------------------------------
+_ascii = frozenset(map(chr, range(128)))
+
+# Tests of the ASCII characters in categories, for str patterns and for
+# patterns with re.ASCII, where \s does not match \x1c-\x1f
+_categories = {
+    sre_parse.CATEGORY_DIGIT: str.isdigit,
+    sre_parse.CATEGORY_SPACE: str.isspace,
+    sre_parse.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+    sre_parse.CATEGORY_LINEBREAK: lambda c: c == '\n',
+}
+_asciicategories = dict(_categories)
+_asciicategories[sre_parse.CATEGORY_SPACE] = lambda c: c in ' \t\n\r\f\v'
+for _table in (_categories, _asciicategories):
+    for _cat, _test in list(_table.items()):
+        _table[getattr(sre_parse, _cat.name.replace('CATEGORY_', 'CATEGORY_NOT_'))] = (
+            lambda test: lambda c: not test(c))(_test)
+
+_repeats = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)}
+_zerowidth = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT}
+
+def _first_chars(regex, reflags):
+    try:
+        parsed = sre_parse.parse(regex, reflags)
+    except Exception:
+        return None
+    flags = parsed.state.flags
+    first = _first_seq(parsed, flags & re.IGNORECASE, _asciicategories if flags & re.ASCII else _categories)
+    if first is None or first[1]:
+        return None
+    return first[0]
+
+# First characters of a sequence of regex items and whether it can be empty
+def _first_seq(items, icase, categories):
+    chars = set()
+    for op, av in items:
+        if op in _zerowidth:
+            continue
+        if op is sre_parse.LITERAL or op is sre_parse.IN:
+            chars1 = {chr(av)} if op is sre_parse.LITERAL else _first_class(av, icase, categories)
+            first = _fold(chars1, icase) if chars1 is not None else None, False
+            if first[0] is None:
+                return None
+        elif op is sre_parse.NOT_LITERAL or op is sre_parse.ANY:
+            first = set(_ascii), False
+        elif op is sre_parse.SUBPATTERN:
+            group, addflags, delflags, sub = av
+            first = _first_seq(sub, (icase or addflags & re.IGNORECASE) and not delflags & re.IGNORECASE,
+                               _asciicategories if addflags & re.ASCII else categories)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            first = _first_seq(av, icase, categories)
+        elif op is sre_parse.BRANCH:
+            first = set(), False
+            for sub in av[1]:
+                f = _first_seq(sub, icase, categories)
+                if f is None:
+                    return None
+                first = first[0] | f[0], first[1] or f[1]
+        elif op in _repeats:
+            lo, hi, sub = av
+            first = _first_seq(sub, icase, categories)
+            if first is not None:
+                first = first[0], first[1] or lo == 0
+        else:
+            return None
+        if first is None:
+            return None
+        chars |= first[0]
+        if not first[1]:
+            return chars, False
+    return chars, True
+
+# First characters of a character class, before folding cases
+def _first_class(items, icase, categories):
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = True
+        elif op is sre_parse.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_parse.RANGE:
+            chars.update(map(chr, range(av[0], min(av[1], 127) + 1)))
+            if av[1] >= 128:
+                chars.add(chr(av[1]))
+        elif op is sre_parse.CATEGORY and av in categories:
+            chars.update(filter(categories[av], _ascii))
+        else:
+            return None
+    if negate:
+        chars = _ascii - chars
+    return chars
+
+# ASCII characters among the characters and, ignoring case, their other cases.
+# None if some are not ASCII, their other cases may be, like 'i' for 'İ'
+def _fold(chars, icase):
+    if icase:
+        if not chars <= _ascii:
+            return None
+        chars = chars | {c.swapcase() for c in chars}
+    return chars & _ascii
+
+# -----------------------------------------------------------------------------
+# _form_first_index()
+#
+# Builds the first character index of a state: for every ASCII character,
+# the master regexs of the rules that can start with it and of the rules
+# whose first characters are not known, in the order of relist.  Characters
+# with the same rules share the regexs, which are formed like the ones in
+# lexre and are lexre itself when all rules are candidates.
+# -----------------------------------------------------------------------------
+def _form_first_index(relist, lexre, reflags, ldict, toknames):
+    firsts = [_first_chars(r, reflags) for r in relist]
+    index = {}
+    formed = {}
+    for c in sorted(_ascii):
+        rules = tuple([i for i, first in enumerate(firsts) if first is None or c in first])
+        if rules not in formed:
+            if len(rules) == len(relist):
+                formed[rules] = lexre
+            else:
+                formed[rules] = _form_master_re([relist[i] for i in rules], reflags, ldict, toknames)[0]
+        index[c] = formed[rules]
+    return index
+
 # -----------------------------------------------------------------------------
 # def _statetoken(s,names)
 #
@@ -770,6 +1474,10 @@ def lex(*, module=None, object=None, debug=False,
 
     lexobj.lextokens_all = lexobj.lextokens | set(lexobj.lexliterals)
 
+    # Type ids for TokenBatch, types set by token rules are added when first seen
+    for n in sorted(lexobj.lextokens_all):
+        lexobj._typeid(n)
+
     # Get the stateinfo dictionary
     stateinfo = linfo.stateinfo
 
@@ -802,6 +1510,7 @@ def lex(*, module=None, object=None, debug=False,
         lexobj.lexstatere[state] = lexre
         lexobj.lexstateretext[state] = re_text
         lexobj.lexstaterenames[state] = re_names
+        lexobj.lexstatefirst[state] = _form_first_index(regexs[state], lexre, reflags, ldict, linfo.toknames)
         if debug:
             for i, text in enumerate(re_text):
                 debuglog.info("lex: state '%s' : regex[%d] = '%s'", state, i, text)
@@ -809,12 +1518,15 @@ def lex(*, module=None, object=None, debug=False,
     # For inclusive states, we need to add the regular expressions from the INITIAL state
     for state, stype in stateinfo.items():
         if state != 'INITIAL' and stype == 'inclusive':
+            first, initial = lexobj.lexstatefirst[state], lexobj.lexstatefirst['INITIAL']
+            lexobj.lexstatefirst[state] = {c: first[c] + initial[c] for c in first}
             lexobj.lexstatere[state].extend(lexobj.lexstatere['INITIAL'])
             lexobj.lexstateretext[state].extend(lexobj.lexstateretext['INITIAL'])
             lexobj.lexstaterenames[state].extend(lexobj.lexstaterenames['INITIAL'])
 
     lexobj.lexstateinfo = stateinfo
     lexobj.lexre = lexobj.lexstatere['INITIAL']
+    lexobj.lexfirst = lexobj.lexstatefirst['INITIAL']
     lexobj.lexretext = lexobj.lexstateretext['INITIAL']
     lexobj.lexreflags = reflags
 
@@ -852,6 +1564,27 @@ def lex(*, module=None, object=None, debug=False,
 
     return lexobj
 
+# -----------------------------------------------------------------------------
+# _ascii_compatible()
+#
+# Whether an encoding encodes ASCII characters as the same single bytes
+# -----------------------------------------------------------------------------
+def _ascii_compatible(encoding):
+    ascii = bytes(range(128))
+    return ascii.decode('ascii').encode(encoding) == ascii
+
+# -----------------------------------------------------------------------------
+# _read_chunks()
+#
+# Generator of the chunks read from a file object by Lexer.input_stream()
+# -----------------------------------------------------------------------------
+def _read_chunks(f, size):
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
 # -----------------------------------------------------------------------------
 # runmain()
 #
@@ -859,27 +1592,29 @@ def lex(*, module=None, object=None, debug=False,
 # -----------------------------------------------------------------------------
 
 def runmain(lexer=None, data=None):
-    if not data:
-        try:
-            filename = sys.argv[1]
-            with open(filename) as f:
-                data = f.read()
-        except IndexError:
-            sys.stdout.write('Reading from standard input (type EOF to end):\n')
-            data = sys.stdin.read()
-
-    if lexer:
-        _input = lexer.input
-    else:
-        _input = input
-    _input(data)
-    if lexer:
-        _token = lexer.token
-    else:
-        _token = token
+    if not lexer:
+        lexer = globals()['lexer']
 
+    if data:
+        lexer.input(data)
+        _runmain_tokens(lexer)
+        return
+
+    # Files and standard input are lexed in chunks rather than read as a whole
+    try:
+        filename = sys.argv[1]
+    except IndexError:
+        sys.stdout.write('Reading from standard input (type EOF to end):\n')
+        lexer.input_stream(sys.stdin)
+        _runmain_tokens(lexer)
+        return
+    with open(filename) as f:
+        lexer.input_stream(f)
+        _runmain_tokens(lexer)
+
+def _runmain_tokens(lexer):
     while True:
-        tok = _token()
+        tok = lexer.token()
         if not tok:
             break
         sys.stdout.write(f'({tok.type},{tok.value!r},{tok.lineno},{tok.lexpos})\n')
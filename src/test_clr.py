@@ -0,0 +1,163 @@
+#!/bin/env python3
+
+# Tests of clr.CLR_Parser table construction and parsing, run with pytest
+
+import importlib.util
+import os
+import pickle
+import random
+
+import pytest
+
+import clr
+import grammars
+import ply.lex as lex
+
+class Tok:
+    def __init__(self, type, lexpos = 0):
+        self.type = type
+        self.value = type
+        self.lexpos = lexpos
+
+def toks(text):
+    return [Tok(t, i) for i, t in enumerate(text.split())]
+
+def cells(table):
+    return [dict([(sym, (a.action, a.number)) for sym, a in row.items()]) for row in table]
+
+def outcome(parse, tokens):
+    try:
+        return parse(tokens)
+    except clr.ParseError as e:
+        return ('error', None if e.token is None else e.token.lexpos)
+
+def sentences(workload, count = 5):
+    #token lists of generated inputs, and each of them with one token dropped
+    func, lexmodule, generate = grammars.workloads[workload]
+    rng = random.Random(1)
+    result = []
+    for seed in range(count):
+        lexer = lex.lex(module = lexmodule)
+        lexer.input(generate(400, seed))
+        tokens = list(lexer)
+        result.append(tokens)
+        broken = list(tokens)
+        del broken[rng.randrange(len(broken))]
+        result.append(broken)
+    return result
+
+def build(func, mode = 'clr', **kwargs):
+    grammar, start, terminals = func()
+    return clr.CLR_Parser(grammar, start, set(terminals), mode = mode, **kwargs)
+
+@pytest.mark.parametrize('workload', sorted(grammars.workloads))
+def test_modes_parse_alike(workload):
+    func = grammars.workloads[workload][0]
+    parsers = [build(func, mode) for mode in ('clr', 'lalr', 'pager')]
+    for tokens in sentences(workload):
+        results = [outcome(p.parse, tokens) for p in parsers]
+        assert results[0] == results[1] == results[2]
+
+def test_nonterminal_tokens_rejected():
+    parser = build(grammars.arith_grammar)
+    assert parser.parse(toks('i + i'))[0] == 'E'
+    for text in ('T', 'F + i', 'E'):
+        with pytest.raises(clr.ParseError):
+            parser.parse(toks(text))
+
+def merge_grammar():
+    return """S -> a A d | b B d | a B e | b A e
+        A -> c
+        B -> c""", 'S', {'a', 'b', 'c', 'd', 'e'}
+
+def test_merged_conflicts():
+    lalr = build(merge_grammar, 'lalr')
+    assert lalr.merge_conflicts
+    assert all([c.merged for c in lalr.report.conflicts])
+    for mode in ('clr', 'pager'):
+        parser = build(merge_grammar, mode)
+        assert parser.report.conflicts == [] and parser.merge_conflicts == []
+        assert parser.parse(toks('b c d')) == ('S', ['b', ('B', ['c']), 'd'])
+
+def test_cached_table(tmp_path):
+    built = build(grammars.json_grammar, 'lalr', cachedir = str(tmp_path))
+    assert built.report.cachefile is None
+    loaded = build(grammars.json_grammar, 'lalr', cachedir = str(tmp_path))
+    assert loaded.report.cachefile is not None
+    assert cells(loaded.table) == cells(built.table)
+    assert loaded.compiled.value == built.compiled.value and loaded.compiled.base == built.compiled.base
+    assert loaded.report.counts == built.report.counts
+    for tokens in sentences('json'):
+        assert outcome(loaded.parse, tokens) == outcome(built.parse, tokens)
+
+def test_cached_table_malformed(tmp_path):
+    built = build(grammars.json_grammar, cachedir = str(tmp_path))
+    filename = os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0])
+    for data in ({'version': clr.tabversion}, {'version': clr.tabversion, 'table': [{'x': (9, 1)}]}, [1, 2]):
+        with open(filename, 'wb') as f:
+            pickle.dump(data, f)
+        parser = build(grammars.json_grammar, cachedir = str(tmp_path))
+        assert parser.report.cachefile is None
+        assert cells(parser.table) == cells(built.table)
+
+def test_module(tmp_path):
+    parser = build(grammars.sql_grammar, 'pager')
+    filename = str(tmp_path / 'sqlparser.py')
+    parser.write_module(filename)
+    spec = importlib.util.spec_from_file_location('sqlparser', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for tokens in sentences('sql') + [[Tok('Expr')]]:
+        try:
+            expected = parser.parse(tokens)
+        except clr.ParseError as e:
+            with pytest.raises(module.ParseError) as info:
+                module.parse(tokens)
+            assert info.value.token is e.token
+        else:
+            assert module.parse(tokens) == expected
+
+def test_workers():
+    serial = build(grammars.c_grammar)
+    parallel = build(grammars.c_grammar, workers = 2)
+    assert cells(parallel.table) == cells(serial.table)
+
+def test_optimize():
+    plain = build(grammars.json_grammar, 'lalr')
+    optimized = build(grammars.json_grammar, 'lalr').optimize()
+    assert len(optimized.table) < len(plain.table)
+    for tokens in sentences('json'):
+        assert (outcome(optimized.parse, tokens)[0] == 'error') == (outcome(plain.parse, tokens)[0] == 'error')
+
+def precedence_grammar():
+    return "E -> E - E | E ^ E | E < E | a", 'E', {'a', '-', '^', '<'}
+
+precedence = [('nonassoc', '<'), ('left', '-'), ('right', '^')]
+
+@pytest.mark.parametrize('mode', ['clr', 'lalr', 'pager'])
+def test_precedence(mode):
+    parser = build(precedence_grammar, mode, precedence = precedence)
+    assert parser.report.conflicts == []
+    a = ('E', ['a'])
+    assert parser.parse(toks('a - a - a')) == ('E', [('E', [a, '-', a]), '-', a])
+    assert parser.parse(toks('a ^ a ^ a')) == ('E', [a, '^', ('E', [a, '^', a])])
+    assert parser.parse(toks('a - a ^ a')) == ('E', [a, '-', ('E', [a, '^', a])])
+    assert parser.parse(toks('a < a - a')) == ('E', [a, '<', ('E', [a, '-', a])])
+    with pytest.raises(clr.ParseError) as info:
+        parser.parse(toks('a < a < a'))
+    assert info.value.token.lexpos == 3
+
+@pytest.mark.parametrize('mode', ['clr', 'lalr', 'pager'])
+def test_rebuild(mode):
+    grammar, start, terminals = grammars.sql_grammar()
+    parser = build(grammars.sql_grammar, mode)
+    for changes in ("Factor -> ID | NUMBER | STRING | ( Expr )", "Where -> WHERE Cond"):
+        rebuilt = parser.rebuild(changes)
+        full = clr.CLR_Parser(clr.patch_grammar(grammar, changes), start, set(terminals), mode = mode)
+        assert rebuilt.report.counts['states_reused'] > 0
+        assert cells(rebuilt.table) == cells(full.table)
+        assert [str(c) for c in rebuilt.report.conflicts] == [str(c) for c in full.report.conflicts]
+        for tokens in sentences('sql'):
+            assert outcome(rebuilt.parse, tokens) == outcome(full.parse, tokens)
+        parser = rebuilt
+        grammar = clr.patch_grammar(grammar, changes)
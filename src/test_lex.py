@@ -0,0 +1,190 @@
+#!/bin/env python3
+
+# Tests of ply.lex input modes, run with pytest
+
+import io
+import re
+
+import pytest
+
+import ply.lex as lex
+import grammars
+from lexers import jsonlex
+
+class SkipLexer:
+    t_ignore = ' \n'
+
+    def __init__(self):
+        self.errors = []
+
+    def t_error(self, t):
+        self.errors.append(t.value)
+        t.lexer.skip(1)
+
+class CommentLexer(SkipLexer):
+    tokens = ('COMMENT', 'DIV', 'ABC', 'A', 'ID')
+    literals = '*'
+    t_COMMENT = r'/\*(.|\n)*?\*/'
+    t_DIV = r'/'
+    t_ABC = r'abc'
+    t_A = r'a'
+    t_ID = r'[b-z]+'
+
+def tokens(lexer):
+    return [(t.type, t.value, t.lineno, t.lexpos) for t in lexer]
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def test_stream_same_tokens():
+    data = grammars.gen_json(20000)
+    lexer = lex.lex(module = jsonlex)
+    lexer.input(data)
+    expected = tokens(lexer)
+    for size in (1, 7, 4096):
+        lexer = lex.lex(module = jsonlex)
+        lexer.input_stream(io.StringIO(data), size)
+        assert tokens(lexer) == expected
+
+def test_stream_bounded():
+    data = grammars.gen_json(500000)
+    lexer = lex.lex(module = jsonlex)
+    lexer.input_stream(io.StringIO(data), 4096, 4096)
+    longest = count = 0
+    while lexer.token():
+        longest = max(longest, lexer.lexlen)
+        count += 1
+    assert count > 50000
+    assert longest <= 2 * 4096 + 4096
+
+def test_stream_earlier_rule_needs_more_input():
+    data = 'x / y /*' + 'c' * 200 + '*/ abc a abcabc'
+    lexer = lex.lex(object = CommentLexer())
+    lexer.input(data)
+    expected = tokens(lexer)
+    assert [t[0] for t in expected] == ['ID', 'DIV', 'ID', 'COMMENT', 'ABC', 'A', 'ABC', 'ABC']
+    for size in (1, 2, 3, 64):
+        lexer = lex.lex(object = CommentLexer())
+        lexer.input_stream(chunks(data, size), size)
+        assert tokens(lexer) == expected
+
+def test_stream_token_longer_than_lookahead():
+    data = 'x ' + 'y' * 200
+    lexer = lex.lex(object = CommentLexer())
+    lexer.input_stream(chunks(data, 16), 16, 64)
+    assert lexer.token().value == 'x'
+    with pytest.raises(lex.LexError):
+        lexer.token()
+
+class WordLexer(SkipLexer):
+    tokens = ('WORD', 'NUMBER')
+    t_WORD = r'\w+'
+
+    def t_NUMBER(self, t):
+        r'[0-9]+\b'
+        t.value = int(t.value)
+        return t
+
+def test_bytes_same_tokens():
+    data = grammars.gen_json(20000)
+    lexer = lex.lex(module = jsonlex)
+    lexer.input(data)
+    expected = tokens(lexer)
+    for buf in (data.encode(), memoryview(data.encode()), bytearray(data.encode())):
+        lexer.input(buf)
+        assert tokens(lexer) == expected
+
+def test_bytes_error_skips_characters():
+    words = WordLexer()
+    lexer = lex.lex(object = words)
+    lexer.input('abc € ½ 12 def'.encode())
+    assert tokens(lexer) == [('WORD', 'abc', 1, 0), ('NUMBER', 12, 1, 11), ('WORD', 'def', 1, 14)]
+    assert [e[0] for e in words.errors] == ['€', '½']
+
+def test_bytes_error_value_bounded():
+    words = WordLexer()
+    lexer = lex.lex(object = words)
+    lexer.input(b'a ' + '€'.encode() * 1000)
+    assert tokens(lexer) == [('WORD', 'a', 1, 0)]
+    assert words.errors[0] == '€' * 80
+
+def test_bytes_unicode_classes():
+    # \w only matches ASCII letters in byte regexs
+    words = WordLexer()
+    lexer = lex.lex(object = words)
+    lexer.input('café au lait')
+    assert [t.value for t in lexer] == ['café', 'au', 'lait']
+    lexer.input('café au lait'.encode())
+    assert [t.value for t in lexer] == ['caf', 'au', 'lait']
+    assert [e[0] for e in words.errors] == ['é']
+
+def test_bytes_encoding_not_ascii_compatible():
+    lexer = lex.lex(object = WordLexer())
+    with pytest.raises(ValueError):
+        lexer.input('abc'.encode('utf-16'), 'utf-16')
+
+class FoldLexer(SkipLexer):
+    tokens = ('DOTTED', 'OTHER')
+    t_DOTTED = r'İx'
+    t_OTHER = r'\S'
+
+def test_first_char_index_case_folding():
+    # 'İ' matches 'i' ignoring case
+    lexer = lex.lex(object = FoldLexer(), reflags = re.VERBOSE | re.IGNORECASE)
+    lexer.input('ix İx')
+    assert [t.type for t in lexer] == ['DOTTED', 'DOTTED']
+
+def test_first_char_index_ascii_categories():
+    # \S matches \x1c with re.ASCII and in byte regexs, not in str regexs
+    lexer = lex.lex(object = FoldLexer(), reflags = re.VERBOSE | re.ASCII)
+    lexer.input('\x1c')
+    assert [t.type for t in lexer] == ['OTHER']
+    folds = FoldLexer()
+    lexer = lex.lex(object = folds)
+    lexer.input('\x1c')
+    assert [t.type for t in lexer] == [] and folds.errors == ['\x1c']
+    lexer.input(b'\x1c')
+    assert [t.type for t in lexer] == ['OTHER']
+
+class IncludeLexer(SkipLexer):
+    tokens = ('NAME', 'INCLUDE')
+    t_NAME = r'[a-z]+'
+
+    def t_INCLUDE(self, t):
+        r'@'
+        t.lexer.input('zz yy')
+        return t
+
+class EofLexer(SkipLexer):
+    tokens = ('LETTERS',)
+    t_LETTERS = r'[a-z]+'
+
+    def __init__(self):
+        super().__init__()
+        self.more = ['cc dd']
+
+    def t_eof(self, t):
+        if self.more:
+            t.lexer.input(self.more.pop())
+            return t.lexer.token()
+
+def batched(lexer, n):
+    result = []
+    while True:
+        batch = lexer.tokenize_batch(n)
+        if not len(batch):
+            return result
+        result += [(t.type, t.value, t.lineno, t.lexpos) for t in batch]
+
+@pytest.mark.parametrize('rules, data', [(IncludeLexer, 'ab @ cd ef'), (EofLexer, 'aa bb')])
+def test_batch_new_input(rules, data):
+    lexer = lex.lex(object = rules())
+    lexer.input(data)
+    expected = tokens(lexer)
+    assert [t[1] for t in expected][-2:] in (['zz', 'yy'], ['cc', 'dd'])
+    lexer = lex.lex(object = rules())
+    assert tokens(lexer.tokenize_all(data)) == expected
+    for n in (1, 2):
+        lexer = lex.lex(object = rules())
+        lexer.input(data)
+        assert batched(lexer, n) == expected